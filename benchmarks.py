@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# coding: utf-8
+'''Benchmarks for plotter
+
+    python benchmarks.py import
+    python benchmarks.py run [--sizes 1000,10000] [--output results.json]
+                             [--compare baseline.json] [--threshold 0.2]
+
+``import`` measures how long ``import plotter`` takes (compared with
+importing the heavy dependencies it loads lazily). ``run`` generates
+synthetic datasets (numeric, date and text columns) and times loading them
+from CSV and every chart method: the call itself (aggregation and artist
+creation), drawing the figure and saving it as PNG (which draws it again;
+``encode`` is the difference). Results can be saved as JSON and compared
+with a previous run: slowdowns bigger than ``threshold`` are reported as
+regressions (and the exit code is 1).
+'''
+
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import numpy
+
+from plotter import ColumnStore, Plotter
+
+
+IMPORT_STATEMENTS = [('plotter', 'import plotter'),
+                     ('numpy + matplotlib',
+                      'import numpy, matplotlib.figure, '
+                      'matplotlib.backends.backend_agg')]
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+CATEGORIES = ['category-%02d' % index for index in range(20)]
+GROUPS = ['group-%d' % index for index in range(5)]
+# (name, method, kwargs, maximum number of rows). Charts that draw one
+# artist per row are only run up to the maximum.
+CHARTS = [('linear', 'linear', {'ignore': ['count'], 'style': '-'}, 10 ** 5),
+          ('linear[downsample]', 'linear',
+           {'ignore': ['count'], 'style': '-', 'downsample': 'minmax'}, None),
+          ('scatter', 'scatter', {'x_column': 'day', 'ignore': ['count']},
+           10 ** 3),
+          ('scatter[downsample]', 'scatter',
+           {'x_column': 'day', 'ignore': ['count'], 'style': '-',
+            'downsample': 'minmax'}, None),
+          ('scatter[density]', 'scatter',
+           {'x_column': 'day', 'ignore': ['count'], 'density': True}, None),
+          ('bar', 'bar', {'x_column': 'category', 'y_columns': ['value']},
+           10 ** 3),
+          ('bar[count]', 'bar', {'count': 'category'}, None),
+          ('bar[aggregate]', 'bar',
+           {'x_column': 'group', 'y_columns': ['value', 'count'],
+            'aggregate': 'mean'}, None),
+          ('stacked_bar', 'stacked_bar',
+           {'x_column': 'category', 'y_column': 'count',
+            'y_labels': 'group'}, None),
+          ('radar', 'radar',
+           {'axis_labels': 'category', 'values': 'count',
+            'legends_column': 'group'}, None),
+          ('radar_area', 'radar_area',
+           {'values_column': 'value', 'labels_column': 'category'}, 10 ** 3),
+          ('pie', 'pie',
+           {'values_column': 'count', 'labels_column': 'group'}, None)]
+
+
+def import_time(statement, runs=7):
+    'Median time (in seconds) ``statement`` takes in a new interpreter'
+    code = ('import time; start = time.time(); %s; '
+            'print(time.time() - start)' % statement)
+    timings = []
+    for run in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code])
+        timings.append(float(output.decode('ascii').strip()))
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def benchmark_import(runs=7):
+    results = {}
+    for name, statement in IMPORT_STATEMENTS:
+        results[name] = import_time(statement, runs)
+        print('%-20s %8.1f ms' % (name, results[name] * 1000))
+    return results
+
+
+def make_dataset(rows, seed=42):
+    'Return a ``ColumnStore`` with ``rows`` rows of random data'
+    random = numpy.random.RandomState(seed)
+    store = ColumnStore()
+    store.add_column('value', random.normal(100, 15, rows), float)
+    store.add_column('count', random.randint(0, 1000, rows), int)
+    days = numpy.sort(random.randint(0, 3650, rows))
+    store.add_column('day', numpy.datetime64('2000-01-01') +
+                            days.astype('timedelta64[D]'), datetime.date)
+    store.add_column('category', numpy.array(CATEGORIES)[
+            random.randint(0, len(CATEGORIES), rows)], str)
+    store.add_column('group', numpy.array(GROUPS)[
+            random.randint(0, len(GROUPS), rows)], str)
+    return store
+
+
+def write_csv(store, filename, chunk_size=100000):
+    'Write a ``ColumnStore`` as a CSV file'
+    with io.open(filename, 'w', encoding='utf-8') as fp:
+        fp.write(u','.join(store.headers) + u'\n')
+        for start in range(0, len(store), chunk_size):
+            rows = slice(start, start + chunk_size)
+            columns = [store.labels(header, rows) for header in store.headers]
+            fp.write(u''.join(u','.join(row) + u'\n'
+                              for row in zip(*columns)))
+
+
+def best_of(function, repeat):
+    'Return the lowest time (in seconds) ``function`` takes'
+    timings = []
+    for run in range(repeat):
+        start = timer()
+        function()
+        timings.append(timer() - start)
+    return min(timings)
+
+
+def benchmark_chart(store, method, kwargs, repeat=3):
+    '''Time a chart method: the call, drawing the figure and saving as PNG
+
+    Saving draws the figure again, so ``encode`` (``save`` minus ``draw``
+    of the same run) is the time spent encoding the PNG.'''
+    timings = {'call': [], 'draw': [], 'save': [], 'encode': []}
+    for run in range(repeat):
+        with Plotter(store) as my_plot:
+            start = timer()
+            getattr(my_plot, method)(**kwargs)
+            timings['call'].append(timer() - start)
+            start = timer()
+            my_plot.fig.canvas.draw()
+            timings['draw'].append(timer() - start)
+            start = timer()
+            my_plot.save(io.BytesIO())
+            timings['save'].append(timer() - start)
+            timings['encode'].append(max(timings['save'][-1] -
+                                         timings['draw'][-1], 0))
+    return {phase: min(values) for phase, values in timings.items()}
+
+
+def run(sizes=None, repeat=3):
+    '''Run the benchmarks for each size and return the results
+
+    Results are a dict: ``{benchmark: {size: {phase: seconds}}}``.'''
+    results = {}
+    for size in sizes or DEFAULT_SIZES:
+        store = make_dataset(size)
+        temp_fp = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+        temp_fp.close()
+        try:
+            write_csv(store, temp_fp.name)
+            load = best_of(lambda: ColumnStore.from_csv(temp_fp.name),
+                           repeat)
+        finally:
+            os.remove(temp_fp.name)
+        results.setdefault('load', {})[str(size)] = {'load': load}
+        aggregate = best_of(lambda: store.aggregate(['group', 'category'],
+                                                    'count'), repeat)
+        results.setdefault('aggregate', {})[str(size)] = \
+                {'aggregate': aggregate}
+        print('%-20s %10d rows  load %.4fs  aggregate %.4fs' % \
+              ('data', size, load, aggregate))
+        for name, method, kwargs, max_rows in CHARTS:
+            if max_rows is not None and size > max_rows:
+                continue
+            timings = benchmark_chart(store, method, kwargs, repeat)
+            results.setdefault(name, {})[str(size)] = timings
+            print('%-20s %10d rows  call %.4fs  draw %.4fs  save %.4fs  '
+                  '(encode %.4fs)' % (name, size, timings['call'],
+                                      timings['draw'], timings['save'],
+                                      timings['encode']))
+    return results
+
+
+def compare(results, baseline, threshold=0.2, minimum=0.001):
+    '''Return the regressions of ``results`` compared with ``baseline``
+
+    A regression is a timing more than ``threshold`` (a fraction) slower
+    than the baseline; timings differing less than ``minimum`` seconds are
+    considered noise. Returns a list of ``(benchmark, size, phase, old,
+    new)``.'''
+    regressions = []
+    for name in sorted(results):
+        for size in sorted(results[name], key=int):
+            for phase, new in sorted(results[name][size].items()):
+                try:
+                    old = baseline[name][size][phase]
+                except KeyError:
+                    continue
+                if new - old > minimum and new > old * (1 + threshold):
+                    regressions.append((name, int(size), phase, old, new))
+    return regressions
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks for plotter')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('import', help='measure import time')
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--sizes', default=None,
+                            help='comma-separated numbers of rows '
+                                 '(default: 1e3 to 1e7)')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--output', help='save results to a JSON file')
+    run_parser.add_argument('--compare', help='JSON file of a previous run')
+    run_parser.add_argument('--threshold', type=float, default=0.2,
+                            help='slowdown reported as regression '
+                                 '(default: 0.2, i.e. 20%%)')
+    args = parser.parse_args(args)
+    if args.command == 'import':
+        benchmark_import()
+        return 0
+    elif args.command != 'run':
+        print(__doc__.strip())
+        return 2
+    sizes = None
+    if args.sizes:
+        sizes = [int(float(size)) for size in args.sizes.split(',')]
+    results = run(sizes, args.repeat)
+    if args.output:
+        report = {'python': platform.python_version(),
+                  'numpy': numpy.__version__,
+                  'matplotlib': __import__('matplotlib').__version__,
+                  'results': results}
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, size, phase, old, new in regressions:
+            print('REGRESSION %s (%d rows) %s: %.4fs -> %.4fs (+%.0f%%)' % \
+                  (name, size, phase, old, new, (new / old - 1) * 100))
+        if regressions:
+            return 1
+        print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
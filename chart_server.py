@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+'''HTTP server of charts (``python -m plotter serve``)
+
+Kept apart from ``plotter`` because it needs Python 3 (``asyncio``).'''
+
+import functools
+import hashlib
+import json
+import os
+import traceback
+
+from plotter import CHART_METHODS, ImageCache, Plotter
+
+
+class ChartServer(object):
+    '''Serves charts as PNG images over HTTP (asyncio, standard library)
+
+    ``GET /chart.png?source=data.csv&method=bar&kwargs={"count": "x"}``
+    (plus optional ``width`` and ``height``) renders ``Plotter(source).bar(
+    count="x")``; ``source`` is relative to ``root`` and can't be outside
+    it. Images are cached in an ``ImageCache`` of ``cache_size`` bytes,
+    keyed by a hash of the source's path, size and modification time and
+    of the normalized arguments -- the key is also the ``ETag``, so
+    ``If-None-Match`` requests get a ``304`` without rendering anything.
+    Concurrent requests for the same chart share a single render; renders
+    run one at a time in a worker thread (matplotlib isn't thread-safe),
+    so the event loop keeps serving cached images meanwhile -- call
+    ``close`` to stop it. ``cache`` (a ``DataCache`` or a path) is used to
+    load the sources.'''
+
+    def __init__(self, root=None, cache_size=64 * 1024 ** 2, cache=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.root = os.path.realpath(root or os.getcwd())
+        self.images = ImageCache(cache_size)
+        self.cache = cache
+        self.renders = 0
+        self._rendering = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def close(self):
+        'Stop the render thread (after the renders in progress)'
+        self._executor.shutdown()
+
+    def parse_query(self, query):
+        '''Return ``(path, method, kwargs, width, height)`` of a query string
+
+        Raises ``ValueError`` if it's not valid.'''
+        from urllib.parse import parse_qs
+        values = parse_qs(query)
+
+        def get(name, default=None):
+            return values.get(name, [default])[-1]
+        source, method = get('source'), get('method')
+        if not source:
+            raise ValueError('source is required')
+        # Symbolic links are followed, so they can't point outside the root
+        path = os.path.realpath(os.path.join(self.root, source))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError('source must be inside the server root')
+        if method not in CHART_METHODS:
+            raise ValueError('method must be one of: %s' % \
+                             ', '.join(CHART_METHODS))
+        kwargs = json.loads(get('kwargs', '{}'))
+        if not isinstance(kwargs, dict):
+            raise ValueError('kwargs must be a JSON object')
+        width, height = int(get('width', 1024)), int(get('height', 768))
+        if not (0 < width <= 10000 and 0 < height <= 10000):
+            raise ValueError('width and height must be between 1 and 10000')
+        return path, method, kwargs, width, height
+
+    def key(self, path, method, kwargs, width, height):
+        'Hash of the source identity and of the (normalized) arguments'
+        stat = os.stat(path)
+        identity = [path, stat.st_size, stat.st_mtime, method,
+                    json.dumps(kwargs, sort_keys=True), width, height]
+        return hashlib.sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+
+    def render_chart(self, path, method, kwargs, width, height):
+        'Render a chart and return the PNG bytes'
+        self.renders += 1
+        with Plotter(path, width=width, height=height,
+                     cache=self.cache) as my_plot:
+            getattr(my_plot, method)(**kwargs)
+            return my_plot.render()
+
+    async def chart(self, request, key):
+        'Return the image of ``request`` (rendering it only if needed)'
+        import asyncio
+        image = self.images.get(key)
+        if image is not None:
+            return image
+        future = self._rendering.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self.render_chart,
+                                          *request)
+            self._rendering[key] = future
+            future.add_done_callback(functools.partial(self._rendered, key))
+        return await asyncio.shield(future)
+
+    def _rendered(self, key, future):
+        del self._rendering[key]
+        if not future.cancelled() and future.exception() is None:
+            self.images.put(key, future.result())
+
+    async def respond(self, method, target, headers):
+        'Return ``(status, headers, body)`` of an HTTP request'
+        from urllib.parse import urlsplit
+        url = urlsplit(target)
+        if url.path != '/chart.png':
+            return 404, {}, b'Not found'
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, b'Method not allowed'
+        try:
+            request = self.parse_query(url.query)
+            key = self.key(*request)
+        except (IOError, OSError):
+            return 404, {}, b'Source not found'
+        except ValueError as exception:
+            return 400, {}, str(exception).encode('utf-8')
+        etag = '"%s"' % key
+        response_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in [value.strip() for value in
+                    headers.get('if-none-match', '').split(',')]:
+            return 304, response_headers, b''
+        try:
+            image = await self.chart(request, key)
+        except (KeyError, TypeError, ValueError) as exception:
+            return 400, {}, str(exception).encode('utf-8')
+        except Exception:
+            error = traceback.format_exc().strip().splitlines()[-1]
+            return 500, {}, error.encode('utf-8')
+        response_headers['Content-Type'] = 'image/png'
+        return 200, response_headers, image
+
+    async def handle(self, reader, writer):
+        'Handle a connection (one request per connection)'
+        from http.client import responses
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if not line.strip():
+                    break
+                name, separator, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.split()
+            if len(parts) != 3:
+                status, response_headers, body = 400, {}, b'Bad request'
+            else:
+                status, response_headers, body = \
+                        await self.respond(parts[0], parts[1], headers)
+            response_headers['Content-Length'] = str(len(body))
+            response_headers['Connection'] = 'close'
+            lines = ['HTTP/1.1 %d %s' % (status, responses[status])]
+            lines.extend('%s: %s' % item
+                         for item in sorted(response_headers.items()))
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            if len(parts) != 3 or parts[0] != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        'Start listening; return the ``asyncio`` server'
+        import asyncio
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def serve(host='127.0.0.1', port=8000, root=None, cache_size=64 * 1024 ** 2,
+          cache=None):
+    'Run a ``ChartServer`` until interrupted'
+    import asyncio
+    chart_server = ChartServer(root, cache_size, cache)
+
+    async def run():
+        server = await chart_server.start(host, port)
+        print('Serving charts from %s on http://%s:%d/chart.png' % \
+              (chart_server.root, host, port))
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        chart_server.close()
+    return 0
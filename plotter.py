@@ -1,27 +1,1923 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import collections
+import csv
 import datetime
-from collections import Counter
-from numpy import linspace, array, zeros, pi, concatenate, arange
-from matplotlib.pyplot import figure
-import matplotlib.cm
-from outputty import Table
+import functools
+import hashlib
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+import time
+import traceback
+from itertools import islice
+
+
+class _LazyModule(object):
+    '''Imports a module only when one of its attributes is first used
+
+    NumPy and matplotlib take hundreds of milliseconds to import, which
+    would be paid by every ``import plotter`` (CLI calls, worker processes)
+    even when no chart is drawn.'''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+numpy = _LazyModule('numpy')
+
+try:
+    unicode
+except NameError:  # Python 3
+    unicode = str
+
+COLUMN_TYPES = ((int, 'int64'), (float, 'float64'))
+TYPE_NAMES = {int: 'int', float: 'float', datetime.date: 'date',
+              datetime.datetime: 'datetime', str: 'str'}
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                                  'plotter')
+AGGREGATES = ('sum', 'count', 'mean', 'min', 'max')
+DOWNSAMPLING_METHODS = ('minmax', 'lttb')
+RESAMPLING_UNITS = {'min': 'm', 'H': 'h', 'h': 'h', 'D': 'D', 'W': 'W',
+                    'M': 'M', 'Y': 'Y'}
+RESAMPLING_AGGREGATES = AGGREGATES + ('band', )
+NUMPY_EXTENSIONS = ('.npy', '.npz')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+SQL_AGGREGATES = {'sum': 'SUM', 'mean': 'AVG', 'min': 'MIN', 'max': 'MAX'}
+CHART_METHODS = ('linear', 'scatter', 'bar', 'stacked_bar', 'radar',
+                 'radar_area', 'pie')
+
+
+class SchemaError(ValueError):
+    'A column is missing or has a value that does not match its type'
+
+
+def _schema_types(schema):
+    '''Return ``{header: type}`` for a schema
+
+    Types can be given as types (``int``, ``float``, ``str``,
+    ``datetime.date``, ``datetime.datetime``) or as their names in
+    ``TYPE_NAMES`` (``'int'``, ``'date'``...).'''
+    names = {name: type_ for type_, name in TYPE_NAMES.items()}
+    types = {}
+    for header, type_ in schema.items():
+        if type_ is unicode:
+            type_ = str
+        type_ = names.get(type_, type_)
+        if type_ not in TYPE_NAMES:
+            raise SchemaError('Unknown type %r for column %r (use one of: '
+                              '%s)' % (type_, header,
+                                       ', '.join(sorted(names))))
+        types[header] = type_
+    return types
+
+
+def _convert_column(values):
+    '''Identify the type of a list of strings and convert it to an array
+
+    Returns ``(type, values)``. Types are tried in the same order outputty
+    does: ``int``, ``float``, ``datetime.date``, ``datetime.datetime`` and
+    ``str``. Empty cells become ``nan``/``NaT`` (an integer column with empty
+    cells is promoted to ``float``).'''
+    values = numpy.array(values, dtype=unicode)
+    empty = values == u''
+    has_empty = empty.any()
+    filled = values[~empty] if has_empty else values
+    if len(filled):
+        for type_, dtype in COLUMN_TYPES:
+            try:
+                converted = filled.astype(dtype)
+            except (ValueError, OverflowError):
+                continue
+            if not has_empty:
+                return type_, converted
+            result = numpy.zeros(len(values), dtype='float64')
+            result[empty] = numpy.nan
+            result[~empty] = converted
+            return float, result
+        lengths = numpy.char.str_len(filled)
+        if (lengths == 10).all():
+            type_, dtype = datetime.date, 'datetime64[D]'
+        elif (lengths >= 16).all():
+            type_, dtype = datetime.datetime, 'datetime64[s]'
+        else:
+            type_ = None
+        if type_ is not None:
+            try:
+                return type_, values.astype(dtype)
+            except ValueError:
+                pass
+    return str, values
+
+
+def _parse_column(values, type_, header=None, first_row=1):
+    '''Convert a list of strings to an array of ``type_``, without detection
+
+    Returns ``(type, values)`` like ``_convert_column`` (an ``int`` column
+    with empty cells becomes ``float``). Raises ``SchemaError`` with the
+    first value that doesn't match (and its row number, counting from
+    ``first_row``).'''
+    values = numpy.array(values, dtype=unicode)
+    if type_ is str:
+        return str, values
+    dtype = {int: 'int64', float: 'float64', datetime.date: 'datetime64[D]',
+             datetime.datetime: 'datetime64[s]'}[type_]
+    empty = values == u''
+    has_empty = type_ in (int, float) and empty.any()
+    try:
+        if not has_empty:
+            return type_, values.astype(dtype)
+        result = numpy.full(len(values), numpy.nan)
+        result[~empty] = values[~empty].astype(dtype)
+        return float, result
+    except (ValueError, OverflowError):
+        for row, value in enumerate(values.tolist()):
+            try:
+                numpy.array([value]).astype(dtype)
+            except (ValueError, OverflowError):
+                if value != u'':
+                    raise SchemaError('Column %r: %r (row %d) is not a valid '
+                                      '%s' % (header, value, row + first_row,
+                                              TYPE_NAMES[type_]))
+        raise
+
+
+def _encode_chunk(type_, values):
+    'Dictionary-encode a text chunk: ``(str, (codes, categories))``'
+    if type_ is not str:
+        return type_, values
+    categories, codes = numpy.unique(numpy.asarray(values, dtype=unicode),
+                                     return_inverse=True)
+    return str, (codes.astype('int32'), categories)
+
+
+def _merge_chunks(chunks):
+    '''Join the ``(type, values)`` chunks of a column read in chunks
+
+    Text chunks are encoded (see ``_encode_chunk``) and chunks of empty
+    cells have type ``None`` and their length as ``values``. Returns
+    ``(values, type, categories)`` (``categories`` is ``None`` if the column
+    isn't text), or ``None`` if the types of the chunks don't match -- then
+    the column has to be read as text. Types are joined like
+    ``_convert_column`` would for the whole column: ``int`` and ``float``
+    (or empty cells in an ``int`` column) become ``float``.'''
+    types = set(type_ for type_, values in chunks if type_ is not None)
+    if not types:
+        types = set([str])
+    if types <= set([int, float]):
+        type_ = int if types == set([int]) and \
+                       all(type_ is int for type_, values in chunks) \
+                else float
+    elif len(types) == 1:
+        type_ = types.pop()
+    else:
+        return None
+    if type_ is str:
+        empty = numpy.array([u''], dtype=unicode)
+        encoded = [values if chunk_type is str
+                   else (numpy.zeros(values, dtype='int32'), empty)
+                   for chunk_type, values in chunks]
+        categories = numpy.unique(numpy.concatenate(
+            [chunk_categories for codes, chunk_categories in encoded]))
+        codes = numpy.concatenate(
+            [numpy.searchsorted(categories, chunk_categories)[codes]
+             for codes, chunk_categories in encoded]).astype('int32')
+        return codes, str, categories
+    dtype = {int: 'int64', float: 'float64', datetime.date: 'datetime64[D]',
+             datetime.datetime: 'datetime64[s]'}[type_]
+    missing = numpy.nan if type_ in (int, float) else 'NaT'
+    values = numpy.concatenate([numpy.full(values, missing, dtype=dtype)
+                                if chunk_type is None
+                                else values.astype(dtype, copy=False)
+                                for chunk_type, values in chunks])
+    return values, type_, None
+
+
+def group_reduce(index, size, values=None, how='sum'):
+    '''Reduce ``values`` grouped by ``index`` (integers in ``[0, size)``)
+
+    ``how`` is one of ``AGGREGATES``. Counts, means and sums of floats are
+    computed with ``bincount``; sums of integers (exact, in ``int64``),
+    minimums and maximums with ``ufunc.at``. Groups without rows are ``0``
+    for sum/count and ``nan`` for mean/min/max.'''
+    if how not in AGGREGATES:
+        raise ValueError('Unknown aggregate %r (use one of: %s)' % \
+                         (how, ', '.join(AGGREGATES)))
+    if how == 'count':
+        return numpy.bincount(index, minlength=size)
+    if how == 'sum' and values.dtype.kind in 'iub':
+        sums = numpy.zeros(size, dtype='int64')
+        numpy.add.at(sums, index, values)
+        return sums
+    if how in ('sum', 'mean'):
+        sums = numpy.bincount(index, weights=values, minlength=size)
+        if how == 'sum':
+            return sums
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return sums / numpy.bincount(index, minlength=size)
+    with numpy.errstate(invalid='ignore'):  # nan values
+        if how == 'min':
+            result = numpy.full(size, numpy.inf)
+            numpy.minimum.at(result, index, values)
+        else:
+            result = numpy.full(size, -numpy.inf)
+            numpy.maximum.at(result, index, values)
+    result[numpy.bincount(index, minlength=size) == 0] = numpy.nan
+    return result
+
+
+def _minmax_indexes(y, buckets):
+    'Indexes of the minimum and maximum of ``y`` in each bucket'
+    bucket_size = -(-len(y) // buckets)
+    number_of_buckets = -(-len(y) // bucket_size)
+    padding = number_of_buckets * bucket_size - len(y)
+    y = numpy.concatenate((y.astype('float64'),
+                           numpy.full(padding, numpy.nan)))
+    missing = numpy.isnan(y)
+    shape = (number_of_buckets, bucket_size)
+    lows = numpy.where(missing, numpy.inf, y).reshape(shape)
+    highs = numpy.where(missing, -numpy.inf, y).reshape(shape)
+    offsets = numpy.arange(number_of_buckets) * bucket_size
+    indexes = numpy.concatenate(([0, len(y) - padding - 1],
+                                 offsets + lows.argmin(axis=1),
+                                 offsets + highs.argmax(axis=1)))
+    return numpy.unique(indexes[indexes < len(y) - padding])
+
+
+def _lttb_indexes(x, y, threshold):
+    'Indexes chosen by Largest-Triangle-Three-Buckets'
+    length = len(y)
+    x, y = x.astype('float64'), y.astype('float64')
+    every = (length - 2) / float(threshold - 2)
+    edges = list((numpy.arange(threshold - 1) * every).astype('int64') + 1)
+    edges.append(length)
+    indexes = [0]
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2]
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = numpy.abs((x[selected] - average_x) *
+                          (y[start:end] - y[selected]) -
+                          (x[selected] - x[start:end]) *
+                          (average_y - y[selected]))
+        selected = start + int(areas.argmax())
+        indexes.append(selected)
+    indexes.append(length - 1)
+    return numpy.array(indexes)
+
+
+def downsample_indexes(y, buckets, method='minmax', x=None):
+    '''Return the indexes of the points of ``y`` to keep when plotting
+
+    ``buckets`` is usually the width, in pixels, of the plot. ``'minmax'``
+    keeps the minimum and the maximum of each bucket (so peaks and valleys
+    are never lost); ``'lttb'`` (Largest-Triangle-Three-Buckets) keeps
+    ``buckets`` points that best preserve the shape of the curve.'''
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError('Unknown downsampling method %r (use one of: %s)' % \
+                         (method, ', '.join(DOWNSAMPLING_METHODS)))
+    length = len(y)
+    if method == 'minmax':
+        if length <= 2 * buckets:
+            return numpy.arange(length)
+        return _minmax_indexes(y, buckets)
+    if length <= buckets or buckets < 3:
+        return numpy.arange(length)
+    if x is None:
+        x = numpy.arange(length)
+    return _lttb_indexes(x, y, buckets)
+
+
+def minmax_pyramid(values, levels):
+    '''Return ``levels`` zoom levels of ``(lows, highs)`` arrays
+
+    The last level has one pixel per value (lows and highs are the values)
+    and each level before it has half as many pixels, with the minimum and
+    the maximum of the two pixels they cover -- so, at level ``z``, pixel
+    ``p`` covers values ``p * r`` to ``(p + 1) * r`` with ``r = 2 **
+    (levels - 1 - z)``. ``nan`` values are ignored.'''
+    lows = highs = numpy.asarray(values, dtype='float64')
+    pyramid = [(lows, highs)]
+    for level in range(levels - 1):
+        if len(lows) % 2:
+            lows = numpy.append(lows, numpy.nan)
+            highs = numpy.append(highs, numpy.nan)
+        lows = numpy.fmin(lows[0::2], lows[1::2])
+        highs = numpy.fmax(highs[0::2], highs[1::2])
+        pyramid.append((lows, highs))
+    pyramid.reverse()
+    return pyramid
+
+
+def density_grid(chunks, shape, x_range, y_range):
+    '''Count how many points fall in each cell of a grid
+
+    ``chunks`` yields ``(x, y)`` pairs of arrays and ``shape`` is the number
+    of ``(columns, rows)`` of the grid, whose edges are fixed by ``x_range``
+    and ``y_range`` (points outside them and NaNs are ignored). Each chunk
+    is binned with ``bincount`` and added to the grid, so memory depends
+    only on the sizes of the grid and of the chunks. Returns an int64 array
+    with ``shape[1]`` rows and ``shape[0]`` columns (as ``imshow`` wants).'''
+    width, height = shape
+    x_min, x_max = x_range
+    y_min, y_max = y_range
+    x_scale = width / float(x_max - x_min) if x_max > x_min else 0.0
+    y_scale = height / float(y_max - y_min) if y_max > y_min else 0.0
+    counts = numpy.zeros(width * height, dtype='int64')
+    for x, y in chunks:
+        x = numpy.asarray(x, dtype='float64')
+        y = numpy.asarray(y, dtype='float64')
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        columns = ((x[inside] - x_min) * x_scale).astype('int64')
+        rows = ((y[inside] - y_min) * y_scale).astype('int64')
+        numpy.minimum(columns, width - 1, out=columns)
+        numpy.minimum(rows, height - 1, out=rows)
+        counts += numpy.bincount(rows * width + columns,
+                                 minlength=width * height)
+    return counts.reshape(height, width)
+
+
+def time_buckets(dates, rule):
+    '''Return ``(index, starts)``: the time bucket of each date, and when
+    each bucket starts
+
+    ``rule`` is a number (optional) and a unit: ``min``, ``H``, ``D``,
+    ``W`` (weeks start on Monday), ``M`` or ``Y`` -- like ``'1H'``,
+    ``'15min'`` or ``'1M'``. Buckets are computed with ``datetime64``
+    arithmetic; ``starts`` has every bucket between the first and the last
+    date, so its length depends on the time range (not on the number of
+    dates). ``dates`` can't have ``NaT``.'''
+    match = re.match(r'^\s*(\d*)\s*([A-Za-z]+)\s*$', rule)
+    if match is None or match.group(2) not in RESAMPLING_UNITS or \
+            int(match.group(1) or 1) < 1:
+        raise ValueError('Invalid resampling rule %r (use a number and one '
+                         'of: %s)' % (rule, ', '.join(RESAMPLING_UNITS)))
+    step, unit = int(match.group(1) or 1), RESAMPLING_UNITS[match.group(2)]
+    dates = numpy.asarray(dates)
+    if not len(dates):
+        return (numpy.array([], dtype='int64'),
+                numpy.array([], dtype='M8[%s]' % unit))
+    offset = numpy.timedelta64(3, 'D')  # 1970-01-01 was a Thursday
+    if unit == 'W':
+        dates = dates.astype('M8[D]') + offset
+    numbers = dates.astype('M8[%s]' % unit).astype('int64') // step
+    first = numbers.min()
+    index = numbers - first
+    starts = ((numpy.arange(index.max() + 1) + first) * step).astype(
+            'M8[%s]' % unit)
+    if unit == 'W':
+        starts = starts.astype('M8[D]') - offset
+    return index, starts
+
+
+def _read_csv(filename, columns=None, chunk_size=None, delimiter=',',
+              encoding='utf-8'):
+    '''Read a CSV file by column, yielding ``(headers, values)`` per chunk
+
+    The first non-empty row has the headers. ``values`` is a list with one
+    list of strings per column in ``columns`` (all columns if ``None``);
+    each chunk has at most ``chunk_size`` rows (``None`` reads everything
+    as one chunk). Short rows are padded with empty strings.'''
+    with io.open(filename, encoding=encoding, newline='') as fp:
+        rows = (row for row in csv.reader(fp, delimiter=delimiter) if row)
+        try:
+            headers = next(rows)
+        except StopIteration:
+            return
+        if columns is None:
+            columns = headers
+        missing = [column for column in columns if column not in headers]
+        if missing:
+            raise SchemaError('Columns not found in %s: %s' % \
+                              (filename, ', '.join(missing)))
+        indexes = [headers.index(column) for column in columns]
+        number_of_columns = len(headers)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            if any(len(row) < number_of_columns for row in chunk):
+                chunk = [row + [u''] * (number_of_columns - len(row))
+                         for row in chunk]
+            yield headers, [[row[index] for row in chunk]
+                            for index in indexes]
+            if chunk_size is None:
+                break
+
+
+def sample_types(filename, sample_size=1000, delimiter=',', encoding='utf-8',
+                 seed=0):
+    '''Identify column types using a sample of the rows of a CSV file
+
+    The sample has the first ``sample_size`` rows plus up to
+    ``sample_size`` rows read at random positions of the file (without
+    reading the rest of it; positions depend on ``seed``, so the same file
+    always gets the same types). Returns ``{header: type}``, to be used as a
+    schema -- if a row outside the sample doesn't match, parsing it raises
+    ``SchemaError``.'''
+    import random
+    with io.open(filename, encoding=encoding, newline='') as fp:
+        rows = (row for row in csv.reader(fp, delimiter=delimiter) if row)
+        headers = next(rows, [])
+        sample = list(islice(rows, sample_size))
+    if len(sample) == sample_size:  # there may be more rows
+        randomizer = random.Random(seed)
+        size = os.path.getsize(filename)
+        offsets = sorted(randomizer.randrange(size)
+                         for index in range(sample_size))
+        with io.open(filename, 'rb') as fp:
+            for offset in offsets:
+                fp.seek(offset)
+                fp.readline()  # skip the (probably partial) row
+                line = fp.readline().decode(encoding, 'replace')
+                row = next(csv.reader([line], delimiter=delimiter), [])
+                if len(row) == len(headers):
+                    sample.append(row)
+    types = {}
+    for index, header in enumerate(headers):
+        values = [row[index] if index < len(row) else u'' for row in sample]
+        types[header] = _convert_column(values)[0]
+    return types
+
+
+def _load_npz(filename):
+    '''Return ``{name: array}`` of a ``.npz`` file
+
+    Members stored without compression (``numpy.savez``) are memory-mapped;
+    compressed ones (``numpy.savez_compressed``) have to be read.'''
+    from numpy.lib import format as npy_format
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, \
+            io.open(filename, 'rb') as fp:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') \
+                   else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                fp.seek(info.header_offset)
+                local_header = struct.unpack('<4s5H3I2H', fp.read(30))
+                fp.seek(sum(local_header[-2:]), 1)  # name and extra field
+                version = npy_format.read_magic(fp)
+                if version == (1, 0):
+                    header = npy_format.read_array_header_1_0(fp)
+                else:
+                    header = npy_format.read_array_header_2_0(fp)
+                shape, fortran_order, dtype = header
+                if not dtype.hasobject:
+                    arrays[name] = numpy.memmap(
+                            filename, dtype=dtype, mode='r',
+                            offset=fp.tell(), shape=shape,
+                            order='F' if fortran_order else 'C')
+                    continue
+            with archive.open(info) as member:
+                arrays[name] = npy_format.read_array(member,
+                                                     allow_pickle=False)
+    return arrays
+
+
+def _get_colormap(colormap):
+    'Return a matplotlib colormap given its name (or the colormap itself)'
+    if not isinstance(colormap, (str, unicode)):
+        return colormap
+    import matplotlib
+    try:
+        return matplotlib.colormaps[colormap]
+    except AttributeError:  # matplotlib < 3.5
+        import matplotlib.cm
+        return matplotlib.cm.get_cmap(colormap)
+
+
+def _split_style(style):
+    '''Return ``(linestyle, marker)`` of a format string like ``'o-'``
+
+    Parsed as ``Axes.plot`` does (colors are skipped): with neither a line
+    style nor a marker the line is solid, otherwise what's missing is
+    ``'None'``.'''
+    from matplotlib import rcParams
+    from matplotlib.lines import lineMarkers, lineStyles
+    linestyle = marker = None
+    index = 0
+    while index < len(style):
+        if style[index:index + 2] in lineStyles:
+            linestyle, index = style[index:index + 2], index + 2
+        elif style[index] in lineStyles:
+            linestyle, index = style[index], index + 1
+        elif style[index] in lineMarkers:
+            marker, index = style[index], index + 1
+        elif style[index] == 'C' and style[index + 1:index + 2].isdigit():
+            index += 2
+        elif style[index] in 'bgrcmykw':
+            index += 1
+        else:
+            raise ValueError('Unrecognized character %r in format string %r'
+                             % (style[index], style))
+    if linestyle is None and marker is None:
+        linestyle = rcParams['lines.linestyle']
+    return linestyle or 'None', marker or 'None'
+
+
+def _argsort(values, descending=False):
+    '''Return the indexes that sort ``values`` (a stable sort: equal values
+    keep their order, also when ``descending``)'''
+    if not descending:
+        return numpy.argsort(values, kind='mergesort')
+    # Sorting the reversed values and reversing the result keeps equal
+    # values in their original order
+    index = numpy.argsort(values[::-1], kind='mergesort')[::-1]
+    return len(values) - 1 - index
+
+
+_UnsimplifiedLine = None
+
+
+def _unsimplified(line):
+    '''Make a ``Line2D`` build its path without simplifying it; return it
+
+    Simplification depends on the whole path, so only then drawing the tail
+    of a line (see ``Plotter.refresh``) gives the same pixels as drawing all
+    of it. Takes effect when the data of the line is set next.'''
+    global _UnsimplifiedLine
+    if _UnsimplifiedLine is None:
+        import matplotlib
+        from matplotlib.lines import Line2D
+
+        class UnsimplifiedLine(Line2D):
+            def recache(self, always=False):
+                with matplotlib.rc_context({'path.simplify': False}):
+                    Line2D.recache(self, always)
+        _UnsimplifiedLine = UnsimplifiedLine
+    line.__class__ = _UnsimplifiedLine
+    return line
+
+
+def _format_labels(values):
+    'Format an array of values as a list of strings to be used as labels'
+    if values.dtype.kind == 'M':
+        labels = numpy.datetime_as_string(values)
+        return [label.replace(u'T', u' ') for label in labels]
+    return [unicode(value) for value in values]
+
+
+class ColumnStore(object):
+    '''Stores tabular data as one typed NumPy array per column
+
+    Numbers are kept as ``int64``/``float64`` arrays, dates as ``datetime64``
+    and text columns are dictionary-encoded: an array of integer codes plus
+    an array with the (sorted) unique values. ``headers`` and ``types`` work
+    like outputty's ``Table`` so chart methods can check column types.'''
+
+    def __init__(self):
+        self.headers = []
+        self.types = {}
+        self._columns = {}
+        self._categories = {}
+        self._factorized = {}
+        self._buffers = {}
+
+    def __len__(self):
+        if not self.headers:
+            return 0
+        return len(self._columns[self.headers[0]])
+
+    def __getitem__(self, header):
+        if header in self._categories:
+            return self._categories[header][self._columns[header]]
+        return self._columns[header]
+
+    def add_column(self, header, values, type_, categories=None):
+        '''Add a column (text columns are dictionary-encoded)
+
+        A text column can be given already encoded: ``values`` are its
+        codes and ``categories`` its sorted unique values.'''
+        if header not in self.types:
+            self.headers.append(header)
+        self.types[header] = type_
+        self._categories.pop(header, None)
+        self._factorized.pop(header, None)
+        self._buffers.pop(header, None)
+        if type_ is str:
+            if categories is None:
+                categories, values = numpy.unique(values, return_inverse=True)
+            self._categories[header] = categories
+            values = values.astype('int32')
+        self._columns[header] = values
+
+    def codes(self, header):
+        'Return ``(codes, categories)`` for a column, factorizing if needed'
+        if header in self._categories:
+            return self._columns[header], self._categories[header]
+        if header not in self._factorized:
+            categories, codes = numpy.unique(self._columns[header],
+                                             return_inverse=True)
+            self._factorized[header] = codes, categories
+        return self._factorized[header]
+
+    def top_k(self, header, k, sketch_size=None):
+        '''Return the ``k`` most frequent values of a column
+
+        Returns ``(values, counts, error, total)``: counts are exact here
+        (``error`` is 0; see ``CsvStream.top_k``) and ``total`` is the
+        number of rows. Ties are ordered by value.'''
+        codes, categories = self.codes(header)
+        counts = numpy.bincount(codes, minlength=len(categories))
+        order = numpy.argsort(-counts, kind='mergesort')[:k]
+        return categories[order], counts[order], 0, len(self)
+
+    def aggregate(self, keys, values=None, how='sum'):
+        '''Group rows by one or two key columns and reduce a value column
+
+        Returns ``(categories, result)``: ``categories`` is a list with the
+        sorted unique values of each key and ``result`` is an array shaped
+        ``(len(categories[0]),)`` or ``(len(categories[0]),
+        len(categories[1]))``. ``values`` is not needed when ``how`` is
+        ``'count'``.'''
+        index, categories = None, []
+        for key in keys:
+            codes, key_categories = self.codes(key)
+            if index is None:
+                index = codes.astype('int64')
+            else:
+                index = index * len(key_categories) + codes
+            categories.append(key_categories)
+        shape = tuple(len(key_categories) for key_categories in categories)
+        size = 1
+        for length in shape:
+            size *= length
+        if values is not None:
+            values = self[values]
+        result = group_reduce(index, size, values, how)
+        return categories, result.reshape(shape)
+
+    def labels(self, header, rows=None):
+        '''Return the values of a column formatted as tick labels
+
+        ``rows`` (a slice or an array of indexes) selects only some rows.'''
+        if rows is None:
+            return _format_labels(self[header])
+        values = self._columns[header][rows]
+        if header in self._categories:
+            values = self._categories[header][values]
+        return _format_labels(values)
+
+    def numeric_chunks(self, headers, chunk_size=1000000):
+        'Yield lists of float arrays (one per header) of ``chunk_size`` rows'
+        for start in range(0, len(self), chunk_size):
+            yield [numpy.asarray(self._columns[header][start:start +
+                                                       chunk_size],
+                                 dtype='float64') for header in headers]
+
+    def append(self, rows):
+        '''Append rows (sequences in ``headers`` order, or dicts)
+
+        Columns have spare capacity and grow in place, so appending takes
+        time proportional to the number of new rows (except when a text
+        column gets new categories and its codes need to be remapped). If
+        any value doesn't fit its column, ``ValueError`` is raised and no
+        column is changed.'''
+        if not rows:
+            return
+        if isinstance(rows[0], dict):
+            columns = [[row.get(header) for row in rows]
+                       for header in self.headers]
+        else:
+            if any(len(row) != len(self.headers) for row in rows):
+                raise ValueError('Rows must have %d values' % \
+                                 len(self.headers))
+            columns = [list(column) for column in zip(*rows)]
+        coerced = []
+        for header, values in zip(self.headers, columns):
+            strings = [u'' if value is None else unicode(value)
+                       for value in values]
+            coerced.append(self._coerce(header, strings))
+        for header, (values, categories, promote) in zip(self.headers,
+                                                         coerced):
+            if promote:
+                self._promote(header)
+            if categories is not None:
+                self._recode(header, categories)
+            self._extend(header, values)
+        self._factorized = {}
+
+    def _coerce(self, header, strings):
+        '''Convert appended strings to the type of a column
+
+        Returns ``(values, categories, promote)``: ``categories`` are the
+        new categories of a text column (``None`` if there are no new ones)
+        and ``promote`` tells if an integer column must become float. The
+        column itself is not changed.'''
+        type_ = self.types[header]
+        if type_ is str:
+            values = numpy.array(strings, dtype=unicode)
+            categories = self._categories[header]
+            merged = numpy.unique(numpy.concatenate((categories, values)))
+            codes = numpy.searchsorted(merged, values).astype('int32')
+            if len(merged) == len(categories):
+                return codes, None, False
+            return codes, merged, False
+        if not any(strings):
+            promote = type_ is int
+            dtype = numpy.dtype('float64') if promote \
+                    else self._columns[header].dtype
+            missing = 'NaT' if dtype.kind == 'M' else numpy.nan
+            return numpy.full(len(strings), missing, dtype=dtype), None, \
+                   promote
+        new_type, values = _convert_column(strings)
+        promote = type_ is int and new_type is float
+        if not promote and new_type is not type_ and \
+                (type_, new_type) not in ((float, int),
+                                          (datetime.datetime, datetime.date)):
+            raise ValueError('Column %r is %s, got %s values' % \
+                             (header, TYPE_NAMES[type_],
+                              TYPE_NAMES[new_type]))
+        dtype = 'float64' if promote else self._columns[header].dtype
+        return values.astype(dtype), None, promote
+
+    def _recode(self, header, categories):
+        'Use new (sorted) categories for a text column, remapping its codes'
+        remap = numpy.searchsorted(categories, self._categories[header])
+        self._columns[header] = remap[self._columns[header]].astype('int32')
+        self._buffers.pop(header, None)
+        self._categories[header] = categories
+
+    def _promote(self, header):
+        'Convert an integer column to float (so it can store nan)'
+        self.types[header] = float
+        self._columns[header] = self._columns[header].astype('float64')
+        self._buffers.pop(header, None)
+
+    def _extend(self, header, values):
+        column = self._columns[header]
+        length, total = len(column), len(column) + len(values)
+        buffer = self._buffers.get(header)
+        if buffer is None or len(buffer) < total:
+            buffer = numpy.empty(max(total, 2 * length, 16),
+                                 dtype=column.dtype)
+            buffer[:length] = column
+            self._buffers[header] = buffer
+        buffer[length:total] = values
+        self._columns[header] = buffer[:total]
+
+    def sort_index(self, header, ordering='asc'):
+        '''Return the indexes that sort the rows by ``header`` (stable)
+
+        Text columns are sorted by their codes (the categories are sorted).'''
+        values = self._columns[header]
+        return _argsort(values, ordering.lower().startswith('desc'))
+
+    @classmethod
+    def from_csv(cls, filename, delimiter=',', encoding='utf-8', schema=None,
+                 sample_size=None, chunk_size=100000):
+        '''Read a CSV file (first non-empty row has the headers)
+
+        Types of the columns are identified by looking at all the values,
+        unless a ``schema`` (``{header: type}``) is given -- then only the
+        columns in it are read and converted to their types directly. With
+        ``sample_size`` (and no schema) the types are identified using a
+        sample of the rows (see ``sample_types``). Values that don't match
+        their column's type raise ``SchemaError``.
+
+        The file is read ``chunk_size`` rows at a time and each chunk is
+        converted (text dictionary-encoded) before the next one is read, so
+        the strings of the whole file are never in memory at once. If the
+        chunks of a column get different types (e.g. numbers, then text)
+        that column is read again as text.'''
+        if schema is None and sample_size is not None:
+            schema = sample_types(filename, sample_size, delimiter, encoding)
+        types = _schema_types(schema) if schema is not None else None
+        names = list(types) if types is not None else None
+        chunks, first_row = None, 1
+        for headers, columns in _read_csv(filename, names, chunk_size,
+                                          delimiter, encoding):
+            names = names or headers
+            if chunks is None:
+                chunks = dict((header, []) for header in names)
+            for header, column in zip(names, columns):
+                if types is not None:
+                    chunk = _parse_column(column, types[header], header,
+                                          first_row)
+                elif any(column):
+                    chunk = _convert_column(column)
+                else:
+                    chunk = None, len(column)
+                chunks[header].append(_encode_chunk(*chunk))
+            first_row += len(columns[0])
+        store = cls()
+        if chunks is None:
+            return store
+        merged = dict((header, _merge_chunks(chunks.pop(header)))
+                      for header in names)
+        mixed = [header for header in names if merged[header] is None]
+        if mixed:
+            chunks = dict((header, []) for header in mixed)
+            for headers, columns in _read_csv(filename, mixed, chunk_size,
+                                              delimiter, encoding):
+                for header, column in zip(mixed, columns):
+                    chunks[header].append(_encode_chunk(str, column))
+            for header in mixed:
+                merged[header] = _merge_chunks(chunks.pop(header))
+        for header in names:
+            store.add_column(header, *merged.pop(header))
+        return store
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''Create a store from NumPy arrays, without copying them
+
+        ``arrays`` is a dict (``{header: array}``), a structured array (one
+        column per field) or a 1-D/2-D array (columns named ``'0'``,
+        ``'1'``...). Numeric and ``datetime64`` arrays -- memory-mapped ones
+        included -- are used as they are (only the pages a chart touches
+        are read); other arrays become text columns.'''
+        if isinstance(arrays, dict):
+            items = list(arrays.items())
+        else:
+            arrays = numpy.asarray(arrays)
+            if arrays.dtype.names:
+                items = [(name, arrays[name]) for name in arrays.dtype.names]
+            elif arrays.ndim == 1:
+                items = [(u'0', arrays)]
+            elif arrays.ndim == 2:
+                items = [(unicode(index), arrays[:, index])
+                         for index in range(arrays.shape[1])]
+            else:
+                raise ValueError('Arrays must have 1 or 2 dimensions')
+        store = cls()
+        for header, values in items:
+            values = numpy.asarray(values)
+            if values.ndim != 1:
+                raise ValueError('Column %r must have 1 dimension' % header)
+            if len(store.headers) and len(values) != len(store):
+                raise ValueError('Column %r has %d rows (expected %d)' % \
+                                 (header, len(values), len(store)))
+            kind = values.dtype.kind
+            if kind in 'iub':
+                type_ = int
+            elif kind == 'f':
+                type_ = float
+            elif kind == 'M':
+                unit = numpy.datetime_data(values.dtype)[0]
+                type_ = datetime.date if unit in ('Y', 'M', 'W', 'D') \
+                        else datetime.datetime
+            elif kind == 'O':
+                type_ = str
+                values = numpy.array([u'' if value is None
+                                      else unicode(value)
+                                      for value in values], dtype=unicode)
+            else:
+                type_, values = str, values.astype(unicode)
+            store.add_column(unicode(header), values, type_)
+        return store
+
+    @classmethod
+    def from_npy(cls, filename):
+        'Memory-map a ``.npy`` or ``.npz`` file (see ``from_arrays``)'
+        if filename.lower().endswith('.npz'):
+            return cls.from_arrays(_load_npz(filename))
+        return cls.from_arrays(numpy.load(filename, mmap_mode='r'))
+
+    @classmethod
+    def from_arrow(cls, filename):
+        '''Memory-map an Arrow IPC file (needs ``pyarrow``)
+
+        Columns in a single chunk and without nulls are used without being
+        copied (see ``from_arrays``).'''
+        try:
+            import pyarrow
+            import pyarrow.ipc
+        except ImportError:
+            raise ImportError('pyarrow is needed to read Arrow IPC files')
+        source = pyarrow.memory_map(filename, 'r')
+        try:
+            table = pyarrow.ipc.open_file(source).read_all()
+        except pyarrow.ArrowInvalid:
+            source.seek(0)
+            table = pyarrow.ipc.open_stream(source).read_all()
+        arrays = {}
+        for header in table.column_names:
+            column = table.column(header)
+            if column.num_chunks == 1:
+                column = column.chunk(0)
+            else:
+                column = column.combine_chunks()
+            try:
+                arrays[header] = column.to_numpy(zero_copy_only=True)
+            except pyarrow.ArrowInvalid:
+                arrays[header] = column.to_numpy(zero_copy_only=False)
+        return cls.from_arrays(arrays)
+
+    @classmethod
+    def from_table(cls, table):
+        'Adapter to load data from an outputty ``Table`` (or alike)'
+        store = cls()
+        for header in table.headers:
+            values = [u'' if value is None else unicode(value)
+                      for value in table[header]]
+            if table.types.get(header, str) in (str, unicode):
+                type_, values = str, numpy.array(values, dtype=unicode)
+            else:
+                type_, values = _convert_column(values)
+            store.add_column(header, values, type_)
+        return store
+
+
+class StreamingAggregate(object):
+    '''Incremental group-by: feed it chunk by chunk, then get ``result()``
+
+    Partial results of each chunk are merged by key, so memory depends on
+    the number of distinct keys and not on the number of rows. Keys are
+    kept as the strings read from the file and only converted (and sorted)
+    at the end, so the result is the same ``ColumnStore.aggregate`` returns
+    for the whole file.'''
+
+    def __init__(self, how='sum'):
+        if how not in AGGREGATES:
+            raise ValueError('Unknown aggregate %r (use one of: %s)' % \
+                             (how, ', '.join(AGGREGATES)))
+        self.how = how
+        self.number_of_keys = None
+        self._counts = {}
+        self._sums = {}
+        self._extremes = {}
+        self._float = False
+
+    def update(self, keys, values=None):
+        'Aggregate a chunk: ``keys`` is a list of string arrays'
+        self.number_of_keys = len(keys)
+        index, categories = None, []
+        for key in keys:
+            key_categories, codes = numpy.unique(key, return_inverse=True)
+            if index is None:
+                index = codes.astype('int64')
+            else:
+                index = index * len(key_categories) + codes
+            categories.append(key_categories)
+        shape = tuple(len(key_categories) for key_categories in categories)
+        size = 1
+        for length in shape:
+            size *= length
+        counts = numpy.bincount(index, minlength=size)
+        cells = counts.nonzero()[0]
+        positions = numpy.unravel_index(cells, shape)
+        cell_keys = list(zip(*[key_categories[position].tolist()
+                               for key_categories, position
+                               in zip(categories, positions)]))
+        for key, count in zip(cell_keys, counts[cells].tolist()):
+            self._counts[key] = self._counts.get(key, 0) + count
+        if self.how in ('sum', 'mean'):
+            self._float = self._float or values.dtype.kind not in 'iub'
+            sums = group_reduce(index, size, values, 'sum')[cells].tolist()
+            for key, value in zip(cell_keys, sums):
+                self._sums[key] = self._sums.get(key, 0) + value
+        elif self.how in ('min', 'max'):
+            function = numpy.minimum if self.how == 'min' else numpy.maximum
+            extremes = group_reduce(index, size, values, self.how)
+            for key, value in zip(cell_keys, extremes[cells].tolist()):
+                if key in self._extremes:
+                    value = float(function(self._extremes[key], value))
+                self._extremes[key] = value
+
+    def result(self):
+        'Return ``(categories, result)`` like ``ColumnStore.aggregate``'
+        cells = list(self._counts)
+        categories, positions = [], []
+        for key_index in range(self.number_of_keys or 1):
+            raw = sorted(set(cell[key_index] for cell in cells))
+            type_, converted = _convert_column(raw)
+            key_categories, codes = numpy.unique(converted,
+                                                 return_inverse=True)
+            mapping = dict(zip(raw, codes.tolist()))
+            positions.append([mapping[cell[key_index]] for cell in cells])
+            categories.append(key_categories)
+        shape = tuple(len(key_categories) for key_categories in categories)
+        size = 1
+        for length in shape:
+            size *= length
+        index = numpy.ravel_multi_index(positions, shape) if cells else \
+                numpy.array([], dtype='int64')
+        counts = numpy.zeros(size, dtype='int64')
+        numpy.add.at(counts, index, [self._counts[cell] for cell in cells])
+        if self.how == 'count':
+            result = counts
+        elif self.how in ('sum', 'mean'):
+            dtype = 'float64' if self._float or self.how == 'mean' \
+                    else 'int64'
+            result = numpy.zeros(size, dtype=dtype)
+            numpy.add.at(result, index, [self._sums[cell] for cell in cells])
+            if self.how == 'mean':
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    result = result / counts
+        else:
+            function = numpy.minimum if self.how == 'min' else numpy.maximum
+            result = numpy.full(size, numpy.inf if self.how == 'min'
+                                      else -numpy.inf)
+            with numpy.errstate(invalid='ignore'):  # nan values
+                function.at(result, index,
+                            [self._extremes[cell] for cell in cells])
+            result[counts == 0] = numpy.nan
+        return categories, result.reshape(shape)
+
+
+class HeavyHitters(object):
+    '''Bounded-memory sketch of the most frequent keys of a stream
+
+    A mergeable Misra-Gries summary: each chunk is counted and merged into
+    at most ``capacity`` counters -- when there are more, the
+    ``capacity + 1``-th biggest count is subtracted from all of them and
+    the ones left without a positive count are dropped. Counts are
+    underestimated by at most ``error`` (which is at most ``total /
+    (capacity + 1)``), so every key more frequent than that is kept.'''
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.total = 0
+        self.error = 0
+        self._keys = numpy.array([], dtype=unicode)
+        self._counts = numpy.array([], dtype='int64')
+
+    def update(self, keys):
+        'Count a chunk of keys (an array)'
+        self.total += len(keys)
+        keys, inverse = numpy.unique(numpy.concatenate([self._keys, keys]),
+                                     return_inverse=True)
+        counts = numpy.bincount(inverse, minlength=len(keys))
+        counts[inverse[:len(self._counts)]] += self._counts - 1
+        if len(keys) > self.capacity:
+            position = len(keys) - self.capacity - 1
+            threshold = numpy.partition(counts, position)[position]
+            counts -= threshold
+            self.error += int(threshold)
+            keep = counts > 0
+            keys, counts = keys[keep], counts[keep]
+        self._keys, self._counts = keys, counts
+
+    def result(self, k=None):
+        'Return ``(keys, counts)`` of the ``k`` most frequent keys'
+        order = numpy.argsort(-self._counts, kind='mergesort')[:k]
+        return self._keys[order], self._counts[order]
+
+
+class CsvStream(object):
+    '''Reads a CSV file in chunks instead of loading it into memory
+
+    Used by ``Plotter(filename, streaming=True)``. Only the columns a chart
+    needs are read, ``chunk_size`` rows at a time, and aggregations are done
+    with ``StreamingAggregate`` -- so ``stacked_bar``, ``radar``,
+    ``bar(count=...)`` and ``pie`` use constant memory, whatever the size of
+    the file. Other charts need the raw values of the columns they plot:
+    ``self[header]`` reads one full column. With a ``schema`` only its
+    columns are available and values are converted to their types directly
+    (see ``ColumnStore.from_csv``).'''
+
+    def __init__(self, filename, chunk_size=100000, delimiter=',',
+                 encoding='utf-8', schema=None):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.headers = []
+        self._types = None
+        self._schema = None
+        with io.open(filename, encoding=encoding, newline='') as fp:
+            for row in csv.reader(fp, delimiter=delimiter):
+                if row:
+                    self.headers = row
+                    break
+        if schema is not None:
+            self._schema = _schema_types(schema)
+            missing = [header for header in self._schema
+                       if header not in self.headers]
+            if missing:
+                raise SchemaError('Columns not found in %s: %s' % \
+                                  (filename, ', '.join(missing)))
+            self.headers = list(self._schema)
+            self._types = dict(self._schema)
+
+    def _convert(self, header, column, chunk=None):
+        '''Convert a column (or a chunk of it) to its type in ``types``
+
+        Raises ``SchemaError`` naming the chunk if a value doesn't match.'''
+        if chunk is None:
+            return _parse_column(column, self.types[header], header)
+        try:
+            return _parse_column(column, self.types[header], header,
+                                 chunk * self.chunk_size + 1)
+        except SchemaError as error:
+            raise SchemaError('%s (in chunk %d of %s)' % \
+                              (error, chunk + 1, self.filename))
+
+    def _chunks(self, columns):
+        for headers, values in _read_csv(self.filename, columns,
+                                         self.chunk_size, self.delimiter,
+                                         self.encoding):
+            yield values
+
+    @property
+    def types(self):
+        '''Column types, identified by ``sample_types`` (the first
+        ``chunk_size`` rows and as many at random positions of the file)
+
+        Every chunk is converted to these types: a value that doesn't match
+        raises ``SchemaError`` (pass a ``schema`` to choose the types).'''
+        if self._types is None:
+            self._types = {header: str for header in self.headers}
+            self._types.update(sample_types(self.filename, self.chunk_size,
+                                            self.delimiter, self.encoding))
+        return self._types
+
+    def __len__(self):
+        return sum(len(values[0]) for values in self._chunks(self.headers[:1]))
+
+    def __getitem__(self, header):
+        column = []
+        for values in self._chunks([header]):
+            column.extend(values[0])
+        return self._convert(header, column)[1]
+
+    def labels(self, header, rows=None):
+        '''Return the values of a column formatted as tick labels
+
+        ``rows`` (a slice or an array of indexes) selects only some rows;
+        then the file is read in chunks and only those rows are kept.'''
+        if rows is None:
+            return _format_labels(self[header])
+        if isinstance(rows, slice):
+            rows = numpy.arange(*rows.indices(len(self)))
+        rows = numpy.asarray(rows, dtype='int64')
+        labels = [None] * len(rows)
+        start = 0
+        for number, values in enumerate(self._chunks([header])):
+            end = start + len(values[0])
+            selected = numpy.nonzero((rows >= start) & (rows < end))[0]
+            if len(selected):
+                column = self._convert(header, values[0], number)[1]
+                for position, label in zip(selected, _format_labels(
+                        column[rows[selected] - start])):
+                    labels[position] = label
+            start = end
+        if None in labels:
+            raise IndexError('row index out of range')
+        return labels
+
+    def sort_index(self, header, ordering='asc'):
+        'Same as ``ColumnStore.sort_index`` (reads the whole column)'
+        return _argsort(self[header], ordering.lower().startswith('desc'))
+
+    def numeric_chunks(self, headers):
+        'Yield lists of float arrays (one per header) for each chunk'
+        for number, chunk in enumerate(self._chunks(headers)):
+            arrays = []
+            for header, column in zip(headers, chunk):
+                type_, values = self._convert(header, column, number)
+                if type_ is str and not any(column):
+                    values = numpy.full(len(column), numpy.nan)
+                elif type_ not in (int, float):
+                    raise ValueError('Column %r is not numeric' % header)
+                arrays.append(values.astype('float64'))
+            yield arrays
+
+    def aggregate(self, keys, values=None, how='sum'):
+        'Same as ``ColumnStore.aggregate``, reading the file in chunks'
+        aggregator = StreamingAggregate(how)
+        columns = list(keys)
+        if values is not None:
+            columns.append(values)
+        for number, chunk in enumerate(self._chunks(columns)):
+            values_array = None
+            if values is not None:
+                column = chunk.pop()
+                type_, values_array = self._convert(values, column, number)
+                if type_ is str and not any(column):
+                    values_array = numpy.full(len(column), numpy.nan)
+                elif type_ not in (int, float):
+                    raise ValueError('Column %r is not numeric' % values)
+            aggregator.update([numpy.array(key, dtype=unicode)
+                               for key in chunk], values_array)
+        if aggregator.number_of_keys is None:
+            aggregator.number_of_keys = len(keys)
+        return aggregator.result()
+
+    def top_k(self, header, k, sketch_size=None):
+        '''Same as ``ColumnStore.top_k``, using a ``HeavyHitters`` sketch
+
+        Memory is bounded by ``sketch_size`` (default: ``max(100 * k,
+        1000)``) counters, whatever the number of distinct values.'''
+        sketch = HeavyHitters(sketch_size or max(100 * k, 1000))
+        for values in self._chunks([header]):
+            sketch.update(numpy.array(values[0], dtype=unicode))
+        keys, counts = sketch.result(k)
+        return (_convert_column(keys.tolist())[1], counts, sketch.error,
+                sketch.total)
+
+
+def _quote_identifier(name):
+    'Quote a table or column name to be used in a SQL statement'
+    return u'"%s"' % name.replace(u'"', u'""')
+
+
+def _declared_type(declared):
+    '''Column type for a SQLite declared type (``None`` if it's unknown)
+
+    Follows SQLite's type affinity rules; dates are stored as text, so only
+    declared ``DATE``/``DATETIME``/``TIMESTAMP`` columns are dates.'''
+    declared = (declared or u'').upper()
+    if u'INT' in declared:
+        return int
+    elif any(name in declared for name in (u'REAL', u'FLOA', u'DOUB')):
+        return float
+    elif u'DATETIME' in declared or u'TIMESTAMP' in declared:
+        return datetime.datetime
+    elif u'DATE' in declared:
+        return datetime.date
+    elif any(name in declared for name in (u'CHAR', u'CLOB', u'TEXT')):
+        return str
+    return None
+
+
+class SqliteSource(object):
+    '''Reads a table (or view) of a SQLite database
+
+    Chart methods ask the data for what they need and SQLite computes it:
+    ``aggregate`` (``stacked_bar``, ``radar``, ``pie``, ``bar(count=...)``
+    and ``bar(aggregate=...)``) runs a ``GROUP BY`` query, ``top_k`` an
+    ``ORDER BY COUNT(*) ... LIMIT`` query and ``self[header]`` (``linear``,
+    ``scatter``) selects only that column -- so only the result of each
+    query is loaded, never the whole table. ``database`` is a filename or a
+    ``sqlite3.Connection``; ``table`` can be omitted if there's only one.
+    Column types come from the declared types or, for columns without one,
+    from the first ``sample_size`` rows.'''
+
+    def __init__(self, database, table=None, sample_size=1000):
+        import sqlite3
+        if isinstance(database, sqlite3.Connection):
+            self._connection = database
+            database = [row[2] for row in database.execute(
+                    u'PRAGMA database_list') if row[1] == u'main'][0]
+        else:
+            self._connection = sqlite3.connect(database)
+        self._database = database
+        self._pid = os.getpid()
+        if table is None:
+            tables = [row[0] for row in self._query(
+                    u"SELECT name FROM sqlite_master WHERE type IN "
+                    u"('table', 'view') AND name NOT LIKE 'sqlite_%' "
+                    u"ORDER BY name")]
+            if len(tables) != 1:
+                raise ValueError('There are %d tables in the database, '
+                                 'choose one: %s' % (len(tables),
+                                                     ', '.join(tables)))
+            table = tables[0]
+        self.table = table
+        self.sample_size = sample_size
+        self._from = _quote_identifier(table)
+        columns = self._query(u'PRAGMA table_info(%s)' % self._from)
+        if not columns:
+            raise ValueError('Table %r not found' % table)
+        self.headers = [column[1] for column in columns]
+        self._declared = {column[1]: _declared_type(column[2])
+                          for column in columns}
+        self._types = None
+
+    @property
+    def connection(self):
+        '''The ``sqlite3.Connection``; forked processes (``Plotter.draw``)
+        open their own, since a connection can't be shared between them
+        (in-memory databases keep the inherited one)'''
+        if self._pid != os.getpid() and self._database:
+            import sqlite3
+            self._connection = sqlite3.connect(self._database)
+            self._pid = os.getpid()
+        return self._connection
+
+    def _query(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def _column_name(self, header):
+        if header not in self.headers:
+            raise KeyError(header)
+        return _quote_identifier(header)
+
+    def _to_array(self, header, values):
+        'Convert values returned by SQLite to a typed array'
+        type_ = self.types[header]
+        if type_ in (int, float):
+            try:
+                return numpy.array(values, dtype=dict(COLUMN_TYPES)[type_])
+            except (TypeError, ValueError):  # NULLs in int columns, text
+                pass
+        strings = [u'' if value is None else unicode(value)
+                   for value in values]
+        return _parse_column(strings, type_, header)[1]
+
+    @property
+    def types(self):
+        '''Column types: declared types or identified using the first
+        ``sample_size`` rows'''
+        if self._types is None:
+            self._types = dict(self._declared)
+            unknown = [header for header in self.headers
+                       if self._types[header] is None]
+            if unknown:
+                rows = self._query(u'SELECT %s FROM %s LIMIT ?' % \
+                        (u', '.join(_quote_identifier(header)
+                                    for header in unknown), self._from),
+                        (self.sample_size, ))
+                for index, header in enumerate(unknown):
+                    strings = [u'' if row[index] is None else
+                               unicode(row[index]) for row in rows]
+                    self._types[header] = _convert_column(strings)[0]
+        return self._types
+
+    def __len__(self):
+        return self._query(u'SELECT COUNT(*) FROM %s' % self._from)[0][0]
+
+    def __getitem__(self, header):
+        rows = self._query(u'SELECT %s FROM %s' % \
+                           (self._column_name(header), self._from))
+        return self._to_array(header, [row[0] for row in rows])
+
+    def labels(self, header, rows=None):
+        '''Return the values of a column formatted as tick labels
+
+        ``rows`` (a slice or an array of indexes) selects only some rows.'''
+        values = self[header]
+        if rows is not None:
+            values = values[rows]
+        return _format_labels(values)
+
+    def numeric_chunks(self, headers, chunk_size=1000000):
+        'Yield lists of float arrays (one per header) of ``chunk_size`` rows'
+        for header in headers:
+            if self.types[header] not in (int, float):
+                raise ValueError('Column %r is not numeric' % header)
+        cursor = self.connection.execute(u'SELECT %s FROM %s' % \
+                (u', '.join(self._column_name(header) for header in headers),
+                 self._from))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            values = numpy.array(rows, dtype='float64').reshape(
+                    len(rows), len(headers))
+            yield [values[:, index] for index in range(len(headers))]
+
+    def sort_index(self, header, ordering='asc'):
+        '''Same as ``ColumnStore.sort_index``, computed by SQLite
+
+        Rows are numbered (``ROW_NUMBER()``, SQLite 3.25+) and sorted with
+        ``ORDER BY``, so only the indexes are loaded. As with the arrays of
+        ``self[header]``, missing numbers and dates sort last (first when
+        descending) and missing text is an empty string.'''
+        direction = u' DESC' if ordering.lower().startswith('desc') else u''
+        if self.types[header] is str:
+            value = u"COALESCE(value, '')"
+        else:
+            value = u'value IS NULL%s, value' % direction
+        rows = self._query(u'SELECT position FROM (SELECT ROW_NUMBER() OVER '
+                           u'() - 1 AS position, %s AS value FROM %s) '
+                           u'ORDER BY %s%s, position' % \
+                           (self._column_name(header), self._from, value,
+                            direction))
+        return numpy.array([row[0] for row in rows], dtype='int64')
+
+    def aggregate(self, keys, values=None, how='sum'):
+        '''Same as ``ColumnStore.aggregate``, computed by SQLite
+
+        Runs ``SELECT keys, SUM(values) ... GROUP BY keys`` (or ``COUNT(*)``,
+        ``AVG``, ``MIN``, ``MAX``): only one row per group is loaded. Unlike
+        ``ColumnStore``, ``NULL`` values are ignored, as in SQL.'''
+        if how not in AGGREGATES:
+            raise ValueError('Unknown aggregate %r (use one of: %s)' % \
+                             (how, ', '.join(AGGREGATES)))
+        columns = u', '.join(self._column_name(key) for key in keys)
+        if how == 'count':
+            expression = u'COUNT(*)'
+        else:
+            if self.types[values] not in (int, float):
+                raise ValueError('Column %r is not numeric' % values)
+            expression = u'%s(%s)' % (SQL_AGGREGATES[how],
+                                      self._column_name(values))
+        rows = self._query(u'SELECT %s, %s FROM %s GROUP BY %s' % \
+                           (columns, expression, self._from, columns))
+        index, categories = None, []
+        for position, key in enumerate(keys):
+            key_categories, codes = numpy.unique(
+                    self._to_array(key, [row[position] for row in rows]),
+                    return_inverse=True)
+            codes = codes.reshape(-1).astype('int64')
+            if index is None:
+                index = codes
+            else:
+                index = index * len(key_categories) + codes
+            categories.append(key_categories)
+        shape = tuple(len(key_categories) for key_categories in categories)
+        size = 1
+        for length in shape:
+            size *= length
+        results = [row[-1] for row in rows]
+        if how in ('count', 'sum') and \
+           all(isinstance(value, int) for value in results):
+            results = numpy.array(results, dtype='int64')
+        else:
+            results = numpy.array([numpy.nan if value is None else value
+                                   for value in results], dtype='float64')
+        if index is None:
+            index = numpy.zeros(0, dtype='int64')
+        # Each row is a group already: rows are only combined when distinct
+        # SQLite values convert to the same value (e.g. 1 and '1')
+        result = group_reduce(index, size, results,
+                              'sum' if how == 'count' else how)
+        return categories, result.reshape(shape)
+
+    def top_k(self, header, k, sketch_size=None):
+        '''Same as ``ColumnStore.top_k``, computed by SQLite
+
+        Counts are exact (``error`` is 0) and ``sketch_size`` is ignored.'''
+        column = self._column_name(header)
+        rows = self._query(u'SELECT %s, COUNT(*) AS count FROM %s GROUP BY %s '
+                           u'ORDER BY count DESC, %s LIMIT ?' % \
+                           (column, self._from, column, column), (k, ))
+        counts = numpy.array([row[1] for row in rows], dtype='int64')
+        return (self._to_array(header, [row[0] for row in rows]), counts, 0,
+                len(self))
+
+
+class DataCache(object):
+    '''On-disk cache of parsed CSV files
+
+    Each entry is a directory with one ``.npy`` file per column (plus one for
+    the categories of text columns) and a ``meta.json`` file; columns are
+    memory-mapped when loaded, so a warm load doesn't parse anything. Entries
+    are keyed by the source's path, size and modification time and by the
+    parser options, so changing the file invalidates its entry (stale
+    entries are never used again). When the cache is bigger than
+    ``max_size`` bytes the least recently used entries are removed.'''
+
+    def __init__(self, path=None, max_size=1024 ** 3):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def key(self, filename, **options):
+        'Return the key of ``filename`` (and parser options) in the cache'
+        stat = os.stat(filename)
+        identity = [os.path.abspath(filename), stat.st_size, stat.st_mtime,
+                    sorted(options.items())]
+        return hashlib.sha1(json.dumps(identity, sort_keys=True)
+                            .encode('utf-8')).hexdigest()
+
+    def load(self, filename, delimiter=',', encoding='utf-8', schema=None,
+             sample_size=None):
+        '''Return a ``ColumnStore`` for a CSV file, parsing it only if needed
+
+        See ``ColumnStore.from_csv`` for the options.'''
+        if schema is not None:
+            schema = {header: TYPE_NAMES[type_] for header, type_
+                      in _schema_types(schema).items()}
+        key = self.key(filename, delimiter=delimiter, encoding=encoding,
+                       schema=schema, sample_size=sample_size)
+        entry = os.path.join(self.path, key)
+        try:
+            store = self._read(entry)
+        except (IOError, OSError, ValueError):
+            store = ColumnStore.from_csv(filename, delimiter=delimiter,
+                                         encoding=encoding, schema=schema,
+                                         sample_size=sample_size)
+            self._write(entry, store, os.path.abspath(filename))
+            self.evict()
+        else:
+            os.utime(os.path.join(entry, 'meta.json'), None)
+        return store
+
+    def _read(self, entry):
+        with io.open(os.path.join(entry, 'meta.json'), encoding='utf-8') as fp:
+            meta = json.load(fp)
+        names = {name: type_ for type_, name in TYPE_NAMES.items()}
+        store = ColumnStore()
+        for index, header in enumerate(meta['headers']):
+            filename = os.path.join(entry, '%d.npy' % index)
+            store.headers.append(header)
+            store.types[header] = names[meta['types'][index]]
+            store._columns[header] = numpy.load(filename, mmap_mode='r')
+            if store.types[header] is str:
+                filename = os.path.join(entry, '%d.categories.npy' % index)
+                store._categories[header] = numpy.load(filename,
+                                                       mmap_mode='r')
+        return store
+
+    def _write(self, entry, store, source):
+        temp_path = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        meta = {'source': source, 'headers': store.headers,
+                'types': [TYPE_NAMES[store.types[header]]
+                          for header in store.headers]}
+        for index, header in enumerate(store.headers):
+            numpy.save(os.path.join(temp_path, '%d.npy' % index),
+                       store._columns[header])
+            if header in store._categories:
+                numpy.save(os.path.join(temp_path,
+                                        '%d.categories.npy' % index),
+                           store._categories[header])
+        with io.open(os.path.join(temp_path, 'meta.json'), 'w',
+                     encoding='utf-8') as fp:
+            fp.write(unicode(json.dumps(meta)))
+        try:
+            os.rename(temp_path, entry)
+        except OSError:  # other process cached it first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def entries(self):
+        '''Return a list of dicts describing the entries in the cache
+
+        Each dict has ``path``, ``source``, ``size`` (in bytes) and
+        ``last_used``. The most recently used entries come first.'''
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            meta_filename = os.path.join(path, 'meta.json')
+            if name.startswith('.') or not os.path.isfile(meta_filename):
+                continue
+            try:
+                with io.open(meta_filename, encoding='utf-8') as fp:
+                    source = json.load(fp)['source']
+                last_used = os.path.getmtime(meta_filename)
+                size = sum(os.path.getsize(os.path.join(path, filename))
+                           for filename in os.listdir(path))
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append({'path': path, 'source': source, 'size': size,
+                            'last_used': last_used})
+        entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+        return entries
+
+    def evict(self):
+        'Remove least recently used entries until the cache fits max_size'
+        total = 0
+        for entry in self.entries():
+            total += entry['size']
+            if total > self.max_size:
+                shutil.rmtree(entry['path'], ignore_errors=True)
+
+    def clear(self):
+        'Remove all entries'
+        for entry in self.entries():
+            shutil.rmtree(entry['path'], ignore_errors=True)
+
+
+def _count_artists(figure):
+    'Number of artists directly inside the axes of ``figure``'
+    if figure is None:
+        return 0
+    return sum(len(axes.get_children()) for axes in figure.axes)
+
+
+class Stats(object):
+    '''Statistics of each phase of a ``Plotter``
+
+    Used by ``Plotter(..., stats=True)`` (or ``stats=Stats(...)``). Loading
+    the data (``load``), ``refresh``, ``save`` and each chart method call
+    add a record to ``records`` -- chart methods add two: computing the
+    data (aggregations, downsampling...: ``bar:data``) and creating the
+    artists (``bar:artists``). A record is a dict with ``phase``,
+    ``seconds`` (wall time), ``rows`` (number of rows in the data; ``None``
+    when streaming, since counting them means reading the file),
+    ``artists`` (artists created in the phase), ``total_artists`` (artists
+    in the figure after the phase), ``peak_memory`` (peak of memory
+    allocated in the phase, in bytes -- only if ``trace_memory``, which
+    uses ``tracemalloc`` and slows things down; ``None`` otherwise) and
+    ``failed`` (if the call raised an exception). Each record is also
+    passed to the ``callbacks``, to export it.'''
+
+    def __init__(self, callbacks=None, trace_memory=False):
+        self.records = []
+        self.callbacks = list(callbacks or [])
+        self.trace_memory = trace_memory
+        self._phases = 0
+        self._started_tracing = False
+        self._running = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def add_callback(self, callback):
+        'Call ``callback(record)`` for each new record'
+        self.callbacks.append(callback)
+
+    def start(self, plotter, split=False):
+        '''Start a phase; pass the returned value to ``finish``
+
+        If ``split``, calls of ``data`` are recorded as a separate phase.'''
+        memory = None
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._phases += 1
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        started = {'time': time.time(), 'artists': _count_artists(plotter.fig),
+                   'memory': memory, 'peak': memory,
+                   'data': {'seconds': 0.0, 'peak': memory} if split
+                           else None}
+        self._running.append(started)
+        return started
+
+    def data(self, function, *args):
+        '''Return ``function(*args)``, counting it in the data phase of the
+        running phase (if it was started with ``split``)'''
+        started = self._running[-1] if self._running else None
+        if started is None or started['data'] is None:
+            return function(*args)
+        start_time = time.time()
+        if started['memory'] is not None:
+            started['peak'] = max(started['peak'], self._peak(reset=True))
+        try:
+            return function(*args)
+        finally:
+            data = started['data']
+            data['seconds'] += time.time() - start_time
+            if started['memory'] is not None:
+                data['peak'] = max(data['peak'], self._peak(reset=True))
+
+    def _peak(self, reset=False):
+        'Peak of traced memory (since the last reset, which can be done now)'
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        if reset and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return peak
+
+    def finish(self, phase, started, plotter, failed=False):
+        'Record a phase, started by ``start``; return its record(s)'
+        seconds = time.time() - started['time']
+        if started in self._running:
+            self._running.remove(started)
+        peak = None
+        if started['memory'] is not None:
+            import tracemalloc
+            peak = max(started['peak'], self._peak())
+            self._phases -= 1
+            if not self._phases and self._started_tracing:
+                # Tracing slows everything down: stop it between phases
+                tracemalloc.stop()
+                self._started_tracing = False
+        data = getattr(plotter, 'data', None)
+        total_artists = _count_artists(plotter.fig)
+        record = {'phase': phase, 'seconds': seconds,
+                  'rows': len(data) if isinstance(data, ColumnStore)
+                          else None,
+                  'artists': max(total_artists - started['artists'], 0),
+                  'total_artists': total_artists,
+                  'peak_memory': None if peak is None
+                                 else max(peak - started['memory'], 0),
+                  'failed': failed}
+        records = [record]
+        if started['data'] is not None:
+            data_record = dict(record, phase=phase + ':data', artists=0,
+                               seconds=started['data']['seconds'])
+            if peak is not None:
+                data_record['peak_memory'] = max(started['data']['peak'] -
+                                                 started['memory'], 0)
+            record.update(phase=phase + ':artists',
+                          seconds=max(seconds - data_record['seconds'], 0))
+            records.insert(0, data_record)
+        for record in records:
+            self.records.append(record)
+            for callback in self.callbacks:
+                callback(record)
+        return records
+
+    def totals(self):
+        'Return a dict with the total seconds spent in each phase'
+        totals = {}
+        for record in self.records:
+            totals[record['phase']] = totals.get(record['phase'], 0.0) + \
+                                      record['seconds']
+        return totals
+
+
+def _instrumented(phase=None, split=False):
+    '''Record calls of a ``Plotter`` method in ``self.stats``
+
+    The phase is named after the method if ``phase`` is ``None``; if
+    ``split``, the time in ``Plotter._prepared`` is recorded apart (see
+    ``Stats``). Calls that raise are recorded too. Costs only an attribute
+    check when stats are disabled.'''
+    def decorator(method):
+        name = phase or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.stats is None:
+                return method(self, *args, **kwargs)
+            started = self.stats.start(self, split)
+            try:
+                result = method(self, *args, **kwargs)
+            except BaseException:
+                self.stats.finish(name, started, self, failed=True)
+                raise
+            self.stats.finish(name, started, self)
+            return result
+        return wrapper
+    return decorator
+
+
+def _deferrable(method):
+    '''Only record calls of a chart method if the plotter is deferred
+
+    Recorded calls are run by ``Plotter.draw``.'''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.deferred:
+            self._calls.append((method.__name__, args, kwargs))
+            return None
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+_save_executor = None
+
+
+def _get_save_executor():
+    'Background thread shared by ``Plotter.save_async`` calls'
+    global _save_executor
+    if _save_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _save_executor = ThreadPoolExecutor(max_workers=1)
+    return _save_executor
+
+
+def _fingerprint(columns, rows):
+    'SHA-1 of the first ``rows`` values of the columns (to spot changes)'
+    digest = hashlib.sha1()
+    for column in columns:
+        digest.update(numpy.ascontiguousarray(column[:rows]).tobytes())
+    return digest.hexdigest()
+
+
+def _render_tile(args):
+    '''Render one tile of ``Plotter.export_tiles`` (run in a worker process)
+
+    ``series`` is a list of ``(x, lows, highs, color)``: ``x`` are the
+    pixel centers, in the tile, of the minimums and maximums to draw.'''
+    filename, series, tile_size, y_range = args
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=(tile_size / 72.0, tile_size / 72.0), dpi=72)
+    FigureCanvasAgg(figure)
+    subplot = figure.add_axes([0, 0, 1, 1])
+    subplot.set_axis_off()
+    for x_values, lows, highs, color in series:
+        subplot.fill_between(x_values, lows, highs, facecolor=color,
+                             edgecolor=color, linewidth=1)
+    subplot.set_xlim(0, tile_size)
+    subplot.set_ylim(y_range)
+    figure.savefig(filename, dpi=72, transparent=True)
+    return filename
+
+
+_deferred_plotter = None
+
+
+def _can_fork():
+    '''Tell if worker processes can be forked: ``fork`` is available and
+    this is the main thread (forking with other threads running is not safe)'''
+    import threading
+    if not hasattr(os, 'fork'):
+        return False
+    thread = threading.current_thread()
+    if hasattr(threading, 'main_thread'):
+        return thread is threading.main_thread()
+    return isinstance(thread, threading._MainThread)  # Python 2
+
+
+def _prepare_call(index):
+    '''Run chart call ``index`` of ``_deferred_plotter`` (in a worker
+    process) and return the data it computed (see ``Plotter.draw``)'''
+    plotter = _deferred_plotter
+    method, args, kwargs = plotter._calls[index]
+    worker = Plotter(rows=plotter.rows, cols=plotter.cols,
+                     width=plotter.width, height=plotter.height,
+                     collections=plotter.collections)
+    worker.data = plotter.data
+    worker._sort_indexes = plotter._sort_indexes
+    worker._subplot_number = plotter._subplot_number + index
+    worker._recorded = []
+    try:
+        getattr(worker, method)(*args, **kwargs)
+        return worker._recorded
+    finally:
+        worker.close()
 
 
 class Plotter(object):
     'Stores information about a plot and plot it'
 
-    def __init__(self, data=None, rows=1, cols=1, width=1024, height=768):
+    def __init__(self, data=None, rows=1, cols=1, width=1024, height=768,
+                 streaming=False, chunk_size=100000, cache=None,
+                 stats=None, collections=False, rasterize_data=False,
+                 schema=None, sample_size=None, table=None, deferred=False,
+                 processes=None):
         self.rows = rows
         self.cols = cols
+        self.width = width
+        self.height = height
+        self.deferred = deferred
+        self.processes = processes
+        self._calls = []
+        self._recorded = None
+        self._replayed = None
+        self.collections = collections
+        self.rasterize_data = rasterize_data
         self._subplot_number = 0
-        self.fig = figure(figsize=(width / 80, height / 80), dpi=80)
-        self._load_data(data)
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = Figure(figsize=(width / 80.0, height / 80.0), dpi=80)
+        FigureCanvasAgg(self.fig)
+        self._series = []
+        self._live_axes = {}
+        self._sort_indexes = {}
+        self._refreshed_rows = None
+        self._drawn = False
+        if stats is True:
+            stats = Stats()
+        elif stats is False:
+            stats = None
+        self.stats = stats
+        self._load_data(data, streaming, chunk_size, cache, schema,
+                        sample_size, table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Release the figure
 
-    def _load_data(self, data):
-        self.data = Table()
-        self.data.read('csv', data)
+        The figure is not registered in ``pyplot`` so, after closing it (or
+        leaving a ``with Plotter(...) as my_plot:`` block), its memory is
+        freed as soon as the ``Plotter`` is not referenced anymore.'''
+        if self.fig is not None:
+            self.fig.clear()
+            self.fig = None
+        self._calls = []
+        self._series = []
+        self._live_axes = {}
+
+    @_instrumented('load')
+    def _load_data(self, data, streaming=False, chunk_size=100000,
+                   cache=None, schema=None, sample_size=None, table=None):
+        is_filename = isinstance(data, (str, unicode))
+        if isinstance(data, (dict, numpy.ndarray)):
+            self.data = ColumnStore.from_arrays(data)
+        elif is_filename and data.lower().endswith(NUMPY_EXTENSIONS):
+            self.data = ColumnStore.from_npy(data)
+        elif is_filename and data.lower().endswith(ARROW_EXTENSIONS):
+            self.data = ColumnStore.from_arrow(data)
+        elif is_filename and data.lower().endswith(SQLITE_EXTENSIONS):
+            self.data = SqliteSource(data, table, sample_size or 1000)
+        elif isinstance(data, SqliteSource):
+            self.data = data
+        elif streaming:
+            if schema is None and sample_size is not None:
+                schema = sample_types(data, sample_size)
+            self.data = CsvStream(data, chunk_size=chunk_size, schema=schema)
+        elif cache is not None and cache is not False and is_filename:
+            if not isinstance(cache, DataCache):
+                cache = DataCache(None if cache is True else cache)
+            self.data = cache.load(data, schema=schema,
+                                   sample_size=sample_size)
+        elif data is None:
+            self.data = ColumnStore()
+        elif isinstance(data, ColumnStore):
+            self.data = data
+        elif hasattr(data, 'headers') and hasattr(data, 'types'):
+            self.data = ColumnStore.from_table(data)
+        else:
+            self.data = ColumnStore.from_csv(data, schema=schema,
+                                             sample_size=sample_size)
 
     def _get_new_subplot(self, projection=None):
         self._subplot_number += 1
@@ -36,13 +1932,635 @@ class Plotter(object):
             return self.fig.add_subplot(self.rows, self.cols,
                                         self._subplot_number)
 
-    def save(self, filename):
+    def _subplot_width(self):
+        'Width, in pixels, of each subplot (used to downsample data)'
+        return max(int(self.fig.get_figwidth() * self.fig.dpi / self.cols), 3)
+
+    def _subplot_size(self):
+        '''Width and height, in pixels, of each subplot with the default
+        subplot parameters (so it doesn't depend on ``subplots_adjust``
+        calls of other charts)'''
+        from matplotlib.figure import SubplotParams
+        params = SubplotParams()
+        width = self.fig.get_figwidth() * self.fig.dpi * \
+                (params.right - params.left) / \
+                (self.cols + params.wspace * (self.cols - 1))
+        height = self.fig.get_figheight() * self.fig.dpi * \
+                 (params.top - params.bottom) / \
+                 (self.rows + params.hspace * (self.rows - 1))
+        return width, height
+
+    def _row_labels_formatter(self, header, first=0, order=None,
+                              labels=None):
+        '''Tick formatter that labels position ``p`` with row ``p - first``
+
+        Used instead of one tick label per row on downsampled plots. Rows
+        are sorted by ``order`` (``(header, ordering)``), if given. The
+        ``labels`` (see ``_row_labels``) are used as they are; others are
+        read only for the ticks that are drawn (so a streamed column isn't
+        loaded).'''
+        from matplotlib.ticker import Formatter
+        plotter = self
+
+        class RowLabels(Formatter):
+            def __init__(self):
+                self.labels = dict(labels or {})
+
+            def read(self, positions):
+                missing = [position for position in positions
+                           if int(round(position)) - first not in
+                           self.labels]
+                if missing:
+                    self.labels.update(plotter._row_labels(header, first,
+                                                           order, missing))
+
+            def set_locs(self, locs):
+                Formatter.set_locs(self, locs)
+                self.read(locs)
+
+            def __call__(self, position, tick_number=None):
+                self.read([position])
+                return self.labels[int(round(position)) - first]
+        return RowLabels()
+
+    def _row_labels(self, header, first, order, positions):
+        '''Return ``{row: label}`` of the rows at tick ``positions`` (row
+        ``p - first``, sorted by ``order``); rows out of range get ``u''``'''
+        rows = self._rows(order)
+        length = len(self.data) if rows is None else len(rows)
+        labels = {int(round(position)) - first: u''
+                  for position in positions}
+        wanted = sorted(row for row in labels if 0 <= row < length)
+        if wanted:
+            indexes = numpy.array(wanted) if rows is None else rows[wanted]
+            labels.update(zip(wanted, self.data.labels(header, indexes)))
+        return labels
+
+    def _rows(self, order):
+        '''Indexes of the rows sorted by ``order`` (``(header, ordering)``,
+        see ``_sort_index``) or ``None``'''
+        return None if order is None else self._sort_index(*order)
+
+    def _labels(self, header, order=None):
+        'Tick labels of all rows of a column, sorted by ``order``'
+        return self.data.labels(header, self._rows(order))
+
+    def _sort_index(self, header, ordering='asc'):
+        '''Return the indexes that sort the rows by ``header`` (stable)
+
+        The data computes them (``sort_index``; SQLite sorts in the
+        database) once per column and direction (until rows are appended)
+        and they are shared by all subplots; the data is never reordered.'''
+        descending = ordering.lower().startswith('desc')
+        length = len(self.data)
+        cached = self._sort_indexes.get((header, descending))
+        if cached is None or cached[0] != length:
+            index = self.data.sort_index(header, ordering)
+            cached = self._sort_indexes[(header, descending)] = length, index
+        return cached[1]
+
+    def _prepared(self, function, *args):
+        '''Return ``function(*args)``: chart methods compute the data they
+        plot (aggregations, downsampling, binning...) through this method
+
+        When ``draw`` runs the calls of a deferred plotter, worker
+        processes record these results and the figure is built replaying
+        them, so only the results cross processes.'''
+        if self._replayed is not None:
+            return self._replayed.popleft()
+        if self.stats is None:
+            result = function(*args)
+        else:
+            result = self.stats.data(function, *args)
+        if self._recorded is not None:
+            self._recorded.append(result)
+        return result
+
+    def _series_data(self, header, first=0, downsample=None, order=None):
+        '''Return ``(x_values, y_values)`` of a ``linear``/``scatter`` series
+
+        x values are row numbers (plus ``first``); ``order`` (``(header,
+        ordering)``) sorts the rows. A column in memory is used as it is;
+        otherwise the values are computed by ``_series_values`` (through
+        ``_prepared``).'''
+        if downsample is None and order is None and \
+           isinstance(self.data, ColumnStore):
+            y_values = self.data[header]
+            x_values = None
+        else:
+            x_values, y_values = self._prepared(self._series_values, header,
+                                                first, downsample, order)
+        if x_values is None:
+            x_values = numpy.arange(first, len(y_values) + first)
+        return x_values, y_values
+
+    def _series_values(self, header, first=0, downsample=None, order=None):
+        '''Return the (sorted and downsampled) ``(x_values, y_values)`` of a
+        series for ``_series_data``; ``x_values`` is ``None`` if they are
+        all the row numbers (so deferred workers don't send them back)'''
+        y_values = self.data[header]
+        rows = self._rows(order)
+        if rows is not None:
+            y_values = y_values[rows]
+        if downsample is None:
+            return None, y_values
+        x_values = numpy.arange(first, len(y_values) + first)
+        indexes = downsample_indexes(y_values, self._subplot_width(),
+                                     downsample, x_values)
+        return x_values[indexes], y_values[indexes]
+
+    def draw(self):
+        '''Run the chart calls recorded by a deferred plotter
+
+        With ``Plotter(..., deferred=True)`` chart methods only record their
+        calls. Here each call is run in a pool of ``processes`` worker
+        processes (default: number of CPUs), which compute the data of the
+        subplots in parallel, and then the figure is built in this process
+        with their results -- so the time is close to the slowest subplot
+        plus building the artists. Workers are forked (and share the data
+        with this process); where ``fork`` is not available, or outside the
+        main thread (forking a process with other threads running is not
+        safe), calls run one after another. ``save`` and ``render`` call
+        this method.'''
+        global _deferred_plotter
+        import multiprocessing
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+        processes = min(self.processes or multiprocessing.cpu_count(),
+                        len(calls))
+        if processes > 1 and _can_fork():
+            # Sort here, once: the workers inherit the indexes
+            for method, args, kwargs in calls:
+                if kwargs.get('order_by') is not None:
+                    self._sort_index(kwargs['order_by'],
+                                     kwargs.get('ordering', 'asc'))
+            self._calls = calls
+            _deferred_plotter = self
+            if hasattr(multiprocessing, 'get_context'):
+                pool = multiprocessing.get_context('fork').Pool(processes)
+            else:  # Python 2 always forks
+                pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_prepare_call, range(len(calls)))
+            finally:
+                pool.close()
+                pool.join()
+                _deferred_plotter = None
+                self._calls = []
+        else:
+            results = [None] * len(calls)
+        self.deferred = False
+        try:
+            for (method, args, kwargs), recorded in zip(calls, results):
+                if recorded is not None:
+                    self._replayed = collections.deque(recorded)
+                try:
+                    getattr(self, method)(*args, **kwargs)
+                finally:
+                    self._replayed = None
+        finally:
+            self.deferred = True
+
+    def _numeric_chunks(self, headers, rows=None):
+        'Same as ``self.data.numeric_chunks``, reading ``rows`` if given'
+        if rows is None:
+            for values in self.data.numeric_chunks(headers):
+                yield values
+        else:
+            yield [numpy.asarray(self.data[header], dtype='float64')[rows]
+                   for header in headers]
+
+    def _track_series(self, subplot, line, header, first, downsample,
+                      labels_column=None):
+        'Remember a line so ``refresh`` can update it with appended rows'
+        if self._refreshed_rows is None:
+            self._refreshed_rows = len(self.data)
+        self._series.append({'subplot': subplot, 'line': line,
+                             'column': header, 'first': first,
+                             'downsample': downsample,
+                             'labels_column': labels_column})
+
+    def append(self, rows):
+        '''Append rows to the data (see ``ColumnStore.append``)
+
+        Call ``refresh`` to update what ``linear`` and ``scatter`` plotted.'''
+        self.data.append(rows)
+
+    @_instrumented()
+    def refresh(self):
+        '''Update ``linear`` and ``scatter`` plots with the appended rows
+
+        Lines get the new data and axes limits grow with some headroom, so
+        most refreshes don't change them. If no limits or ticks changed
+        since the last refresh only the part of the axes where the lines
+        grew is drawn on the canvas (and blitted), so the cost depends on
+        the number of new rows; otherwise the whole figure is drawn again.
+        Scatter plots label every row (their ticks change with each new
+        row) and downsampled or dashed lines change along their whole
+        length, so those always redraw the whole figure. Returns the number
+        of new rows.'''
+        if self.collections:
+            raise ValueError('refresh needs lines: use '
+                             'Plotter(..., collections=False)')
+        length = len(self.data)
+        start = self._refreshed_rows
+        if start is None or length == start:
+            return 0
+        redraw = not self._drawn
+        for series in self._series:
+            redraw = self._refresh_series(series, start, length) or redraw
+        for subplot, state in self._live_axes.items():
+            if state.get('tick_labels') is not None:
+                state['tick_labels'].extend(self.data.labels(
+                        state['x_column'], slice(start, length)))
+                subplot.set_xticks(numpy.arange(1, length + 1))
+                subplot.set_xticklabels(state['tick_labels'])
+                subplot.set_xlim(0, length + 1)
+                redraw = True
+        if redraw:
+            self.fig.canvas.draw()
+            self._drawn = True
+            self._pin_legends()
+        else:
+            self._draw_new_segments(start, length)
+        self._refreshed_rows = length
+        return length - start
+
+    def _pin_legends(self):
+        '''Keep legends of updated axes where they were last drawn
+
+        A legend placed at the 'best' location could move when rows are
+        appended, which only a full redraw would show.'''
+        renderer = self.fig.canvas.get_renderer()
+        for series in self._series:
+            legend = series['subplot'].get_legend()
+            if legend is None:
+                continue
+            x, y = series['subplot'].transAxes.inverted().transform(
+                    legend.get_window_extent(renderer).p0)
+            legend.set_loc((x, y))
+
+    def _refresh_series(self, series, start, length):
+        'Update the data of a line; return True if the axes changed'
+        subplot, line, first = series['subplot'], series['line'], \
+                               series['first']
+        x_values = numpy.arange(first, length + first)
+        y_values = self.data[series['column']]
+        if series['downsample'] is None:
+            # The path is built again only when the whole line is drawn
+            _unsimplified(line)
+            line.set_data(x_values, y_values)
+            new_x, new_y = x_values[start:], y_values[start:]
+        else:
+            indexes = downsample_indexes(y_values, self._subplot_width(),
+                                         series['downsample'], x_values)
+            line.set_data(x_values[indexes], y_values[indexes])
+            if series['labels_column'] is not None:
+                subplot.xaxis.set_major_formatter(self._row_labels_formatter(
+                        series['labels_column'], first=first))
+            new_x, new_y = x_values, y_values
+        # Dash patterns would restart where a redrawn tail starts
+        changed = series['downsample'] is not None or \
+                  line.get_linestyle() not in ('-', 'None')
+        fixed_y = self._live_axes.get(subplot, {}).get('fixed_y', False)
+        return self._grow_limits(subplot, new_x, new_y, fixed_y) or changed
+
+    def _grow_limits(self, subplot, x_values, y_values, fixed_y=False):
+        'Extend axes limits (with headroom) to fit new points'
+        changed = False
+        x_min, x_max = subplot.get_xlim()
+        highest = float(x_values.max())
+        if highest > x_max:
+            subplot.set_xlim(x_min, x_min + (highest - x_min) * 1.25)
+            changed = True
+        y_values = y_values.astype('float64')
+        y_values = y_values[~numpy.isnan(y_values)]
+        if fixed_y or not len(y_values):
+            return changed
+        y_min, y_max = subplot.get_ylim()
+        lowest, highest = float(y_values.min()), float(y_values.max())
+        if lowest < y_min or highest > y_max:
+            margin = (max(highest, y_max) - min(lowest, y_min)) * 0.1
+            if lowest < y_min:
+                y_min = lowest - margin
+            if highest > y_max:
+                y_max = highest + margin
+            subplot.set_ylim(y_min, y_max)
+            changed = True
+        return changed
+
+    def _draw_new_segments(self, start, length):
+        '''Draw again only the part of the axes where the lines grew
+
+        Each axes is drawn with just the tails of its lines (the rows from a
+        few pixels left of the last old point on) and only the pixels right
+        of that point are kept, so grids, legends and line joins come out
+        as in a full redraw but the cost depends on the number of new rows
+        (the lines themselves are only built again by full redraws).'''
+        from matplotlib.lines import Line2D
+        from matplotlib.transforms import Bbox
+        canvas = self.fig.canvas
+        renderer = canvas.get_renderer()
+        subplots = []
+        for series in self._series:
+            if series['subplot'] not in subplots:
+                subplots.append(series['subplot'])
+        for subplot in subplots:
+            series_list = [series for series in self._series
+                           if series['subplot'] is subplot]
+            pad = max(max(series['line'].get_linewidth(),
+                          series['line'].get_markersize())
+                      for series in series_list) * self.fig.dpi / 72.0 + 2
+            left = min(subplot.transData.transform(
+                    (start - 1 + series['first'], 0))[0]
+                       for series in series_list) - pad
+            # Lines can touch the pixels just outside the axes
+            x0, y0, x1, y1 = subplot.bbox.extents
+            dirty = Bbox.from_extents(max(int(left), int(x0) - 1),
+                                      int(y0) - 1, int(x1) + 2, int(y1) + 2)
+            if dirty.width <= 0:
+                continue
+            tail_start = subplot.transData.inverted().transform(
+                    (dirty.x0 - pad, 0))[0]
+            saved = canvas.copy_from_bbox(self.fig.bbox)
+            tails = []
+            for series in series_list:
+                line = series['line']
+                first_row = min(max(int(numpy.floor(tail_start)) -
+                                    series['first'], 0), start - 1)
+                tail = _unsimplified(Line2D(
+                        numpy.arange(first_row, length) + series['first'],
+                        self.data[series['column']][first_row:length]))
+                tail.update_from(line)
+                tail.set_zorder(line.get_zorder())
+                line.set_visible(False)
+                subplot.add_artist(tail)
+                tails.append((line, tail))
+            try:
+                self.fig.patch.draw(renderer)
+                subplot.draw(renderer)
+            finally:
+                for line, tail in tails:
+                    tail.remove()
+                    line.set_visible(True)
+            drawn = canvas.copy_from_bbox(dirty)
+            canvas.restore_region(saved)
+            canvas.restore_region(drawn)
+            canvas.blit(dirty)
+
+    def _plot_series(self, subplot, x_values, y_values, style, color,
+                     label=None):
+        '''Plot a series, returning the artist to use in legends
+
+        If ``self.collections`` the line is a ``LineCollection`` and the
+        markers a ``PathCollection`` (instead of a ``Line2D``), which vector
+        formats write out much more compactly.'''
+        if not self.collections:
+            return subplot.plot(x_values, y_values, style, color=color,
+                                label=label)[0]
+        from matplotlib import rcParams
+        from matplotlib.collections import LineCollection
+        linestyle, marker = _split_style(style)
+        handle = None
+        if linestyle not in (None, 'None', '', ' '):
+            points = numpy.column_stack([numpy.asarray(x_values, 'float64'),
+                                         numpy.asarray(y_values, 'float64')])
+            handle = LineCollection([points], colors=[color],
+                                    linestyles=linestyle, label=label)
+            subplot.add_collection(handle)
+        if marker not in (None, 'None', '', ' '):
+            markers = subplot.scatter(x_values, y_values, marker=marker,
+                                      color=[color],
+                                      s=rcParams['lines.markersize'] ** 2,
+                                      zorder=2,
+                                      label=None if handle else label)
+            handle = handle or markers
+        subplot.autoscale_view()
+        return handle
+
+    def _plot_bars(self, subplot, lefts, heights, width, color, bottom=None,
+                   label=None):
+        '''Plot bars, returning the artist to use in legends
+
+        If ``self.collections`` all bars are one ``PolyCollection`` instead
+        of one ``Rectangle`` each.'''
+        if not self.collections:
+            return subplot.bar(lefts, heights, width, color=color,
+                               bottom=bottom, label=label)[0]
+        from matplotlib.collections import PolyCollection
+        lefts = numpy.asarray(lefts, dtype='float64') - width / 2.0
+        heights = numpy.asarray(heights, dtype='float64')
+        if bottom is None:
+            bottom = numpy.zeros(len(heights))
+        rights, tops = lefts + width, bottom + heights
+        vertices = numpy.stack([numpy.column_stack([lefts, bottom]),
+                                numpy.column_stack([lefts, tops]),
+                                numpy.column_stack([rights, tops]),
+                                numpy.column_stack([rights, bottom])],
+                               axis=1)
+        bars = PolyCollection(vertices, facecolors=[color], label=label)
+        bars.sticky_edges.y.append(0)
+        subplot.add_collection(bars)
+        subplot.autoscale_view()
+        return bars
+
+    @_instrumented()
+    def save(self, filename, format=None, dpi=None, compression=None):
+        '''Save the figure to a filename or file-like object
+
+        The format is chosen by the extension if ``format`` is ``None``.
+        ``dpi`` defaults to the figure's and ``compression`` is the zlib
+        level (0-9) of PNG files. If ``self.rasterize_data`` lines, markers,
+        bars and images are embedded as bitmaps in vector formats (SVG,
+        PDF...), while axes, labels and legends are kept as vectors.'''
+        options = {}
+        if format is not None:
+            options['format'] = format
+        if dpi is not None:
+            options['dpi'] = dpi
+        if compression is not None:
+            extension = format
+            if format is None and isinstance(filename, (str, unicode)):
+                extension = os.path.splitext(filename)[1][1:]
+            if (extension or 'png').lower() != 'png':
+                raise ValueError('compression is only supported for PNG')
+            options['pil_kwargs'] = {'compress_level': compression}
+        self.draw()
+        if self.rasterize_data:
+            for axes in self.fig.axes:
+                for artists in (axes.lines, axes.patches, axes.collections,
+                                axes.images):
+                    for artist in artists:
+                        artist.set_rasterized(True)
         #self.fig.savefig(filename, bbox_inches='tight', pad_inches=0.1)
-        self.fig.savefig(filename)
+        self.fig.savefig(filename, **options)
+
+    def render(self, fp=None, format='png', dpi=None, compression=None):
+        '''Render the figure in memory (see ``save`` for the options)
+
+        Returns the bytes of the image or, if ``fp`` (a file-like object) is
+        given, writes them to it and returns ``fp``.'''
+        if fp is not None:
+            self.save(fp, format=format, dpi=dpi, compression=compression)
+            return fp
+        output = io.BytesIO()
+        self.save(output, format=format, dpi=dpi, compression=compression)
+        return output.getvalue()
+
+    def save_async(self, filename, format=None, dpi=None, compression=None,
+                   executor=None):
+        '''Save the figure in another thread; return a ``Future``
+
+        Drawing and encoding run in ``executor`` (by default, one background
+        thread shared by all plotters, so saves run one after another); the
+        future's result is ``filename``. The
+        plotter must not be changed (nor closed) until the future is done.
+        Chart calls of a deferred plotter are run first, in this thread
+        (``draw`` only uses worker processes from the main thread).'''
+        if executor is None:
+            executor = _get_save_executor()
+        if self.deferred:
+            self.draw()
+
+        def save():
+            self.save(filename, format=format, dpi=dpi,
+                      compression=compression)
+            return filename
+        return executor.submit(save)
+
+    def export_tiles(self, directory, x_column=None, ignore='',
+                     tile_size=256, levels=None, y_range=None, colors=None,
+                     colormap='PRGn', processes=None):
+        '''Export the numeric columns as tiles of a min/max zoom pyramid
+
+        Each column (except ``x_column`` and the ``ignore``d ones) is
+        reduced by ``minmax_pyramid`` and every zoom level is drawn as
+        ``tile_size`` x ``tile_size`` transparent PNGs,
+        ``directory/<level>/<tile>.png``, rendered by a pool of
+        ``processes`` workers (default: number of CPUs). At level 0 a
+        pixel covers ``2 ** (levels - 1)`` rows and at the last level one
+        row; by default there are enough levels for level 0 to fit the data
+        in one tile. ``directory/manifest.json`` describes the pyramid for
+        a viewer.
+
+        If the directory already has a compatible export of the same data
+        with fewer rows (e.g. after ``append``; the manifest has a
+        ``fingerprint`` of the exported rows), only the tiles with new rows
+        are rendered again -- unless the new values are out of its
+        ``y_range`` (pass ``y_range`` to fix it). Returns the list of
+        rendered tiles.'''
+        import math
+        import multiprocessing
+        from matplotlib.colors import to_hex
+        ignore = set(ignore)
+        headers = [header for header in self.data.headers
+                   if header != x_column and header not in ignore and
+                   self.data.types[header] in (int, float)]
+        columns = [numpy.asarray(self.data[header], dtype='float64')
+                   for header in headers]
+        rows = len(columns[0]) if columns else 0
+        if colors is None:
+            color_range = numpy.linspace(0, 0.9, len(headers))
+            colormap = _get_colormap(colormap)
+            colors = [colormap(i) for i in color_range]
+        colors = [to_hex(color) for color in colors[:len(headers)]]
+        manifest_filename = os.path.join(directory, 'manifest.json')
+        previous = None
+        if os.path.exists(manifest_filename):
+            with io.open(manifest_filename, encoding='utf-8') as fp:
+                previous = json.load(fp)
+        if levels is None:
+            levels = int(math.ceil(math.log(max(float(rows) / tile_size, 1),
+                                            2))) + 1
+            # Keep the levels of the previous export if they're still enough
+            if previous is not None and previous['tile_size'] == tile_size \
+               and previous['levels'] > levels:
+                levels = previous['levels']
+        if y_range is None:
+            y_min = min([numpy.nanmin(column) for column in columns
+                         if not numpy.isnan(column).all()] or [0.0])
+            y_max = max([numpy.nanmax(column) for column in columns
+                         if not numpy.isnan(column).all()] or [1.0])
+            if previous is not None and \
+               previous['y_range'][0] <= y_min <= y_max <= \
+               previous['y_range'][1]:
+                y_range = previous['y_range']
+            else:
+                margin = (y_max - y_min) * 0.05 or 0.5
+                y_range = [float(y_min - margin), float(y_max + margin)]
+        y_range = [float(value) for value in y_range]
+        series = [{'header': header, 'color': color}
+                  for header, color in zip(headers, colors)]
+        first_new_row = 0
+        if previous is not None:
+            if previous['tile_size'] == tile_size and \
+               previous['levels'] == levels and \
+               previous['y_range'] == y_range and \
+               previous['series'] == series and previous['rows'] <= rows and \
+               previous.get('fingerprint') == _fingerprint(columns,
+                                                           previous['rows']):
+                first_new_row = previous['rows']
+            else:
+                for level in range(previous['levels']):
+                    shutil.rmtree(os.path.join(directory, str(level)),
+                                  ignore_errors=True)
+        pyramids = [minmax_pyramid(column, levels) for column in columns]
+        jobs, zoom = [], []
+        for level in range(levels):
+            rows_per_pixel = 2 ** (levels - 1 - level)
+            pixels = (rows + rows_per_pixel - 1) // rows_per_pixel
+            tiles = (pixels + tile_size - 1) // tile_size
+            zoom.append({'level': level, 'rows_per_pixel': rows_per_pixel,
+                         'rows_per_tile': rows_per_pixel * tile_size,
+                         'tiles': tiles})
+            level_directory = os.path.join(directory, str(level))
+            if not os.path.isdir(level_directory):
+                os.makedirs(level_directory)
+            # Tiles also draw the pixel before and after them (so lines
+            # continue across tiles): new rows change the tile with their
+            # first pixel and the one before it
+            first_tile = max(first_new_row // rows_per_pixel - 1, 0) // \
+                         tile_size
+            for tile in range(first_tile, tiles):
+                start = max(tile * tile_size - 1, 0)
+                stop = min((tile + 1) * tile_size + 1, pixels)
+                x_values = numpy.arange(start, stop) - tile * tile_size + 0.5
+                tile_series = []
+                for pyramid, color in zip(pyramids, colors):
+                    lows, highs = pyramid[level]
+                    tile_series.append((x_values, lows[start:stop],
+                                        highs[start:stop], color))
+                jobs.append((os.path.join(level_directory, '%d.png' % tile),
+                             tile_series, tile_size, y_range))
+        processes = processes or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        try:
+            rendered = pool.map(_render_tile, jobs,
+                                chunksize=max(len(jobs) // (8 * processes),
+                                              1))
+        finally:
+            pool.close()
+            pool.join()
+        manifest = {'tile_size': tile_size, 'levels': levels, 'rows': rows,
+                    'y_range': y_range, 'series': series, 'zoom': zoom,
+                    'tiles': '{level}/{tile}.png', 'x_column': x_column,
+                    'fingerprint': _fingerprint(columns, rows)}
+        if x_column is not None and rows:
+            first, last = _format_labels(self.data[x_column][[0, -1]])
+            manifest['x_range'] = [first, last]
+        temp_filename = manifest_filename + '.tmp'
+        with io.open(temp_filename, 'w', encoding='utf-8') as fp:
+            fp.write(unicode(json.dumps(manifest, indent=2, sort_keys=True)))
+        os.rename(temp_filename, manifest_filename)
+        return rendered
 
+    @_deferrable
+    @_instrumented(split=True)
     def linear(self, title='', grid=True, style='o-', x_labels=None,
                legends=True, ignore='', colors=None,
-               colormap=matplotlib.cm.PRGn):
+               colormap='PRGn', downsample=None, resample=None,
+               resample_how='mean'):
         if legends is None or legends is True:
             legends = {header: header for header in self.data.headers}
         subplot = self._get_new_subplot()
@@ -53,25 +2571,47 @@ class Plotter(object):
             if header != x_labels and self.data.types[header] in (int, float):
                 columns_to_plot.append(header)
         if colors is None:
-            color_range = linspace(0, 0.9, len(columns_to_plot))
+            color_range = numpy.linspace(0, 0.9, len(columns_to_plot))
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
+        if resample is not None:
+            if x_labels is None:
+                raise ValueError('resample needs x_labels (a date column)')
+            self._plot_resampled(subplot, x_labels, columns_to_plot,
+                                 resample, resample_how, style, colors,
+                                 legends)
+            subplot.legend()
+            return
         for header in columns_to_plot:
-                subplot.plot(self.data[header], style, label=legends[header],
-                             color=colors.pop(0))
+            x_values, y_values = self._series_data(header, 0, downsample)
+            line = self._plot_series(subplot, x_values, y_values, style,
+                                     colors.pop(0), legends[header])
+            if not self.collections:
+                self._track_series(subplot, line, header, 0, downsample,
+                                   x_labels if downsample is not None
+                                   else None)
         if x_labels is not None:
-            subplot.set_xticklabels(self.data[x_labels])
+            if downsample is None:
+                subplot.set_xticklabels(self._prepared(self.data.labels,
+                                                       x_labels))
+            else:
+                subplot.xaxis.set_major_formatter(
+                        self._row_labels_formatter(x_labels))
         subplot.legend()
 
+    @_deferrable
+    @_instrumented(split=True)
     def scatter(self, x_column, title='', grid=True, labels=True, legends=True,
                 style='o-', ignore='', colors=None,
-                colormap=matplotlib.cm.PRGn, order_by=None, ordering='asc',
+                colormap='PRGn', order_by=None, ordering='asc',
                 x_label=None, y_lim=None, legend_location='upper center',
-                legend_box=(0.5, 2.2), y_label=''):
+                legend_box=(0.5, 2.2), y_label='', downsample=None,
+                density=False, density_colormap='gist_heat_r',
+                resample=None, resample_how='mean'):
         subplot = self._get_new_subplot()
         subplot.set_title(title)
         subplot.grid(grid)
-        if order_by is not None:
-            self.data.order_by(order_by, ordering)
+        order = None if order_by is None else (order_by, ordering)
         if legends is True:
             legends = {header: header for header in self.data.headers}
         if self.data.types[x_column] in (datetime.date, datetime.datetime):
@@ -81,34 +2621,188 @@ class Plotter(object):
                 x_label = x_column
             subplot.set_xlabel(x_label)
             subplot.set_ylabel(y_label)
-        x_values = range(1, len(self.data[x_column]) + 1)
-        subplot.set_xlim(0, max(x_values) + 1)
         columns_to_plot = []
         for header in set(self.data.headers) - set(ignore):
             if header != x_column and self.data.types[header] in (int, float):
                 columns_to_plot.append(header)
+        if density:
+            self._scatter_density(subplot, x_column, columns_to_plot,
+                                  density, density_colormap, y_lim, order)
+            return
         if colors is None:
-            color_range = linspace(0, 0.9, len(columns_to_plot))
+            color_range = numpy.linspace(0, 0.9, len(columns_to_plot))
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
+        if resample is not None:
+            self._plot_resampled(subplot, x_column, columns_to_plot,
+                                 resample, resample_how, style, colors,
+                                 legends)
+            if y_lim is not None:
+                subplot.set_ylim(y_lim)
+            if legends is not None:
+                subplot.legend(loc=legend_location, bbox_to_anchor=legend_box)
+                self.fig.subplots_adjust(top=0.5, right=0.9)
+            return
+        length = self._prepared(len, self.data)
+        x_values = numpy.arange(1, length + 1)
+        subplot.set_xlim(0, length + 1)
         for header in columns_to_plot:
-            if legends is None:
-                subplot.plot(x_values, self.data[header], style,
-                             color=colors.pop(0))
-            else:
-                subplot.plot(x_values, self.data[header], style,
-                             label=legends[header], color=colors.pop(0))
-        subplot.set_xticks(x_values)
-        subplot.set_xticklabels(self.data[x_column])
+            header_x_values, y_values = self._series_data(header, 1,
+                                                          downsample, order)
+            line = self._plot_series(subplot, header_x_values, y_values,
+                                     style, colors.pop(0),
+                                     None if legends is None
+                                     else legends[header])
+            # Sorted rows can't be updated by ``refresh``
+            if not self.collections and order is None:
+                self._track_series(subplot, line, header, 1, downsample,
+                                   x_column if downsample is not None
+                                   else None)
+        if order is None:
+            self._live_axes[subplot] = {'fixed_y': y_lim is not None,
+                                        'x_column': x_column}
+        if downsample is None:
+            tick_labels = self._prepared(self._labels, x_column, order)
+            if order is None:
+                self._live_axes[subplot]['tick_labels'] = tick_labels
+            subplot.set_xticks(x_values)
+            subplot.set_xticklabels(tick_labels)
+        else:
+            self._label_rows(subplot, x_column, length, order)
         if y_lim is not None:
             subplot.set_ylim(y_lim)
         if legends is not None:
             subplot.legend(loc=legend_location, bbox_to_anchor=legend_box)
             self.fig.subplots_adjust(top=0.5, right=0.9)
 
+    def _label_rows(self, subplot, x_column, length, order=None):
+        '''Label some of the ``length`` rows of a subplot with the values of
+        ``x_column`` (the labels of the first ticks are read by
+        ``_prepared``)'''
+        from matplotlib.ticker import MaxNLocator
+        locator = MaxNLocator(integer=True)
+        labels = self._prepared(self._row_labels, x_column, 1, order,
+                                locator.tick_values(0, length + 1))
+        subplot.xaxis.set_major_locator(locator)
+        subplot.xaxis.set_major_formatter(self._row_labels_formatter(
+                x_column, first=1, order=order, labels=labels))
+
+    def _plot_resampled(self, subplot, date_column, headers, rule, how,
+                        style, colors, legends=None):
+        '''Plot ``headers`` aggregated in time buckets of ``date_column``
+
+        ``rule`` is a ``time_buckets`` rule and ``how`` one of
+        ``RESAMPLING_AGGREGATES`` (``'band'`` plots the mean and fills
+        between the minimum and the maximum). There is one point per
+        bucket, and dates are ticked by a date locator instead of one label
+        per row.'''
+        from matplotlib.dates import (AutoDateLocator, ConciseDateFormatter,
+                                      date2num)
+        if self.data.types[date_column] not in (datetime.date,
+                                                datetime.datetime):
+            raise ValueError('Column %r is not a date column' % date_column)
+        if how not in RESAMPLING_AGGREGATES:
+            raise ValueError('Unknown aggregate %r (use one of: %s)' % \
+                             (how, ', '.join(RESAMPLING_AGGREGATES)))
+        for header in headers:
+            starts, y_values, band = self._prepared(self._resampled,
+                                                    date_column, header,
+                                                    rule, how)
+            x_values = date2num(starts)
+            color = colors.pop(0)
+            if band is not None:
+                subplot.fill_between(x_values, band[0], band[1],
+                                     color=color, alpha=0.3, linewidth=0)
+            self._plot_series(subplot, x_values, y_values, style, color,
+                              None if legends is None else legends[header])
+        locator = AutoDateLocator()
+        subplot.xaxis.set_major_locator(locator)
+        subplot.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+
+    def _resampled(self, date_column, header, rule, how):
+        '''Return ``(starts, values, band)`` for ``_plot_resampled``
+
+        ``band`` is ``(minimums, maximums)`` if ``how`` is ``'band'``.'''
+        dates = self.data[date_column]
+        values = numpy.asarray(self.data[header], dtype='float64')
+        keep = ~numpy.isnat(dates) & ~numpy.isnan(values)
+        index, starts = time_buckets(dates[keep], rule)
+        values = values[keep]
+        band = None
+        if how == 'band':
+            band = (group_reduce(index, len(starts), values, 'min'),
+                    group_reduce(index, len(starts), values, 'max'))
+        return starts, group_reduce(index, len(starts), values,
+                                    'mean' if how == 'band' else how), band
+
+    def _scatter_density(self, subplot, x_column, headers, density,
+                         colormap, y_lim=None, order=None):
+        '''Draw the points of ``headers`` as a 2D histogram
+
+        The grid has one cell per pixel of the subplot (or per ``density`` x
+        ``density`` pixels, if it's an int) and is drawn as a single image,
+        so drawing and saving cost the same whatever the number of rows.
+        The data is read in chunks twice: to find the ranges, then to bin.
+        ``order`` (``(header, ordering)``) sorts the rows.'''
+        from matplotlib.colors import LogNorm
+        pixels = 1 if density is True else max(int(density), 1)
+        width, height = self._subplot_size()
+        shape = (max(int(width / pixels), 1), max(int(height / pixels), 1))
+        rows, y_range, grid = self._prepared(self._density, headers, shape,
+                                             y_lim, order)
+        subplot.set_xlim(0, rows + 1)
+        self._label_rows(subplot, x_column, rows, order)
+        if grid is None:
+            return
+        x_range = (0.5, rows + 0.5)
+        image = subplot.imshow(numpy.ma.masked_equal(grid, 0),
+                               extent=x_range + y_range,
+                               origin='lower', aspect='auto',
+                               interpolation='nearest',
+                               cmap=_get_colormap(colormap),
+                               norm=LogNorm(vmin=1, vmax=max(grid.max(), 1)))
+        subplot.set_xlim(0, rows + 1)
+        subplot.set_ylim(y_range)
+        self.fig.colorbar(image, ax=subplot).set_label('points')
+
+    def _density(self, headers, shape, y_lim=None, order=None):
+        '''Return ``(rows, y_range, grid)`` for ``_scatter_density``
+
+        ``grid`` (and ``y_range``) are ``None`` if there's nothing to bin.'''
+        indexes = self._rows(order)
+        rows, y_min, y_max = 0, numpy.inf, -numpy.inf
+        for values in self._numeric_chunks(headers, indexes):
+            rows += len(values[0])
+            for y_values in values:
+                y_values = y_values[~numpy.isnan(y_values)]
+                if len(y_values):
+                    y_min = min(y_min, y_values.min())
+                    y_max = max(y_max, y_values.max())
+        if y_lim is not None:
+            y_min, y_max = y_lim
+        if not rows or y_min > y_max:
+            return rows, None, None
+        if y_min == y_max:
+            y_min, y_max = y_min - 0.5, y_max + 0.5
+
+        def points():
+            first = 1
+            for values in self._numeric_chunks(headers, indexes):
+                x_values = numpy.arange(first, first + len(values[0]))
+                first += len(values[0])
+                for y_values in values:
+                    yield x_values, y_values
+        grid = density_grid(points(), shape, (0.5, rows + 0.5),
+                            (y_min, y_max))
+        return rows, (y_min, y_max), grid
+
+    @_deferrable
+    @_instrumented(split=True)
     def bar(self, title='', grid=True, count=None, bar_width=0.8, x_column='',
             bar_start=0.5, bar_increment=1.0, legends=True,
-            x_rotation=0, colors=None, colormap=matplotlib.cm.PRGn,
-            y_label=None, y_lim=None, y_columns=None):
+            x_rotation=0, colors=None, colormap='PRGn',
+            y_label=None, y_lim=None, y_columns=None, aggregate=None,
+            top_k=None, other=False, sketch_size=None):
         if legends is True:
             legends = {header: header for header in self.data.headers}
         subplot = self._get_new_subplot()
@@ -116,10 +2810,21 @@ class Plotter(object):
         subplot.grid(grid)
         bar_offset = (bar_increment - bar_width) / 2.0
         bars_titles = []
-        if count is not None:
-            counter = Counter(self.data[count])
-            xticklabels = counter.keys()
-            columns_to_plot = [[counter[k] for k in xticklabels]]
+        xticklabels = None
+        count_error = 0
+        if count is not None and top_k is not None:
+            categories, counts, count_error, total = \
+                    self._prepared(self.data.top_k, count, top_k, sketch_size)
+            xticklabels = _format_labels(categories)
+            if other:
+                xticklabels.append(u'Other' if other is True else other)
+                counts = numpy.append(counts, total - counts.sum())
+            columns_to_plot = [counts]
+        elif count is not None:
+            (categories, ), counts = self._prepared(self.data.aggregate,
+                                                    [count], None, 'count')
+            xticklabels = _format_labels(categories)
+            columns_to_plot = [counts]
             if y_columns is not None:
                 columns_to_plot = y_columns
         else:
@@ -127,20 +2832,31 @@ class Plotter(object):
             if y_columns is None:
                 y_columns = self.data.headers[:]
             for header in y_columns:
+                if aggregate is not None and header == x_column:
+                    continue
                 if self.data.types[header] in (int, float):
-                    columns_to_plot.append(self.data[header])
+                    if aggregate is None:
+                        columns_to_plot.append(self._prepared(
+                                self.data.__getitem__, header))
+                    else:
+                        (categories, ), values = \
+                                self._prepared(self.data.aggregate,
+                                               [x_column], header, aggregate)
+                        xticklabels = _format_labels(categories)
+                        columns_to_plot.append(values)
                     bars_titles.append(header)
         bar_width /= float(len(columns_to_plot))
         bars = []
         if colors is None:
-            color_range = linspace(0, 0.9, len(columns_to_plot))
+            color_range = numpy.linspace(0, 0.9, len(columns_to_plot))
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
         for index, column in enumerate(columns_to_plot):
             left = bar_start + index * bar_width
             lefts = [bar_offset + left + i * bar_increment \
                      for i in range(len(column))]
-            bars.append(subplot.bar(lefts, column, bar_width,
-                                    color=colors.pop(0))[0])
+            bars.append(self._plot_bars(subplot, lefts, column, bar_width,
+                                        colors.pop(0)))
         xticks = [bar_start + bar_increment * (i + 0.5) \
                   for i in range(len(lefts))]
         subplot.set_xticks(xticks)
@@ -150,110 +2866,292 @@ class Plotter(object):
             if count is None:
                 bars_titles = [legends[header] \
                                for header in bars_titles]
-                xticklabels = self.data[x_column]
+            elif count_error:
+                bars_titles = [u'%s (counts up to %d too low)' % \
+                               (legends[count], count_error)]
             else:
                 bars_titles = [legends[count]]
             subplot.legend(bars, bars_titles)
-        else:
-            xticklabels = self.data[x_column]
+        if xticklabels is None and x_column:
+            xticklabels = self._prepared(self.data.labels, x_column)
+        elif xticklabels is None:  # no x column: number the bars
+            xticklabels = [unicode(i + 1) for i in range(len(lefts))]
         subplot.set_xticklabels(xticklabels, rotation=x_rotation)
         if y_label is not None:
             subplot.set_ylabel(y_label)
         if y_lim is not None:
             subplot.set_ylim(y_lim)
 
+    @_deferrable
+    @_instrumented(split=True)
     def stacked_bar(self, x_column, y_column, y_labels=None, title='',
                     grid=True, bar_width=0.5, x_rotation=0, legends=True,
                     legend_location='upper left', legend_box=(-0.4, 1),
-                    colors=None, colormap=matplotlib.cm.gist_heat):
+                    colors=None, colormap='gist_heat'):
         subplot = self._get_new_subplot()
         subplot.set_title(title)
         subplot.grid(grid)
         x_offset = (1.0 - bar_width) / 2
-        x_values_unique = list(set(self.data[x_column]))
-        x_values = array(range(len(set(self.data[x_column]))))
+        categories, data = self._prepared(self.data.aggregate,
+                                          [y_labels, x_column], y_column)
+        y_labels_values, x_values_unique = categories
+        x_values = numpy.arange(len(x_values_unique))
         subplot.set_xticks(x_values + x_offset)
-        subplot.set_xticklabels(x_values_unique, rotation=x_rotation)
-        y_labels_values = list(set(self.data[y_labels]))
-        y_labels_values.sort()
-        data = {y: Counter() for y in y_labels_values}
+        subplot.set_xticklabels(_format_labels(x_values_unique),
+                                rotation=x_rotation)
         if colors is None:
-            color_range = linspace(0, 0.9, len(data.keys()))
+            color_range = numpy.linspace(0, 0.9, len(y_labels_values))
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
-        for row in self.data.to_list_of_dicts(encoding=None):
-            data[row[y_labels]][row[x_column]] += row[y_column]
-        bottom = zeros(len(x_values))
-        for y in y_labels_values:
-            values = [data[y][x] for x in x_values_unique]
-            subplot.bar(x_values, values, width=bar_width, label=unicode(y),
-                        color=colors.pop(0), bottom=bottom)
-            bottom = [bottom[index] + value \
-                      for index, value in enumerate(values)]
+        bottom = numpy.zeros(len(x_values))
+        for y, values in zip(_format_labels(y_labels_values), data):
+            self._plot_bars(subplot, x_values, values, bar_width,
+                            colors.pop(0), bottom=bottom, label=y)
+            bottom = bottom + values
         if legends:
             subplot.legend(loc=legend_location, bbox_to_anchor=legend_box)
         self.fig.subplots_adjust(bottom=0.1, left=0.25)
 
+    @_deferrable
+    @_instrumented(split=True)
     def radar(self, axis_labels, values, legends_column, title='',
               x_grid=False, y_grid=True, fill_alpha=0.5, colors=None,
-              colormap=matplotlib.cm.gist_heat,
+              colormap='gist_heat',
               legend_location='upper left', legend_box=(-0.4, 1),
               legends=False):
         subplot = self._get_new_subplot(projection='polar')
         subplot.set_title(title)
         subplot.xaxis.grid(x_grid)
         subplot.yaxis.grid(y_grid)
-        axis_labels_values = list(set(self.data[axis_labels]))
-        axis_labels_values.sort()
+        categories, curves = self._prepared(self.data.aggregate,
+                                            [legends_column, axis_labels],
+                                            values)
+        legends_values, axis_labels_values = categories
         number_of_axis = len(axis_labels_values)
-        axis_angles = 2 * pi * linspace(0, 1 - 1.0 / number_of_axis,
-                                        number_of_axis)
-        subplot.set_thetagrids(axis_angles * 180 / pi, axis_labels_values)
-        legends_values = list(set(self.data[legends_column]))
-        legends_values.sort()
+        axis_angles = 2 * numpy.pi * numpy.linspace(0,
+                                                    1 - 1.0 / number_of_axis,
+                                                    number_of_axis)
+        subplot.set_thetagrids(axis_angles * 180 / numpy.pi,
+                               _format_labels(axis_labels_values))
         if colors is None:
             len_legends = len(legends_values)
-            color_range = linspace(0, 1 - 1.0 / len_legends, len_legends)
+            color_range = numpy.linspace(0, 1 - 1.0 / len_legends, len_legends)
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
-        curves = {x: Counter() for x in legends_values}
-        self.data.order_by(axis_labels)
-        for row in self.data.to_list_of_dicts(encoding=None):
-            curves[row[legends_column]][row[axis_labels]] += row[values]
-        for key in legends_values:
-            values = [curves[key][x] for x in axis_labels_values]
+        for values in curves:
             color = colors.pop(0)
             lines = subplot.plot(axis_angles, values, color=color)
             subplot.fill(axis_angles, values, facecolor=color,
                          alpha=fill_alpha)
             x, y = lines[0].get_data()
-            new_x = concatenate((x, [x[0]]))
-            new_y = concatenate((y, [y[0]]))
+            new_x = numpy.concatenate((x, [x[0]]))
+            new_y = numpy.concatenate((y, [y[0]]))
             lines[0].set_data(new_x, new_y)
         if legends:
-            subplot.legend(legends_values, loc=legend_location,
+            subplot.legend(_format_labels(legends_values), loc=legend_location,
                            bbox_to_anchor=legend_box)
 
+    @_deferrable
+    @_instrumented(split=True)
     def radar_area(self, values_column, labels_column, title='',
                    x_grid=False, y_grid=True, fill_alpha=0.5, colors=None,
-                   colormap=matplotlib.cm.gist_heat, spacing=0.05):
+                   colormap='gist_heat', spacing=0.05):
         subplot = self._get_new_subplot(projection='polar')
         subplot.set_title(title)
         subplot.xaxis.grid(x_grid)
         subplot.yaxis.grid(y_grid)
-        values = self.data[values_column]
-        labels = self.data[labels_column]
+        values = self._prepared(self.data.__getitem__, values_column)
+        labels = self._prepared(self.data.labels, labels_column)
         if colors is None:
             len_labels = len(labels)
-            color_range = linspace(0, 1 - 1.0 / len_labels, len_labels)
+            color_range = numpy.linspace(0, 1 - 1.0 / len_labels, len_labels)
+            colormap = _get_colormap(colormap)
             colors = [colormap(i) for i in color_range]
-        xticks = arange(0, 2 * pi, 2 * pi / len(labels)) + spacing / 2.0
+        xticks = numpy.arange(0, 2 * numpy.pi, 2 * numpy.pi / len(labels)) + \
+                 spacing / 2.0
         width = xticks[1] - xticks[0] - spacing
         subplot.bar(xticks, values, width=width, color=colors,
                     alpha=fill_alpha)
         subplot.set_xticks(xticks + width / 2.0)
         subplot.set_xticklabels(labels)
 
+    @_deferrable
+    @_instrumented(split=True)
     def pie(self, values_column, labels_column, title=''):
         subplot = self._get_new_subplot()
-        subplot.pie(self.data[values_column], labels=self.data[labels_column],
+        (labels, ), values = self._prepared(self.data.aggregate,
+                                            [labels_column], values_column)
+        subplot.pie(values, labels=_format_labels(labels),
                     autopct='%2.2f%%')
         subplot.set_title(title)
+
+
+def render(spec, cache=None):
+    '''Render a chart spec and save it
+
+    ``spec`` is a dict with ``source`` (a CSV filename), ``output`` (the
+    image filename), ``charts`` (a list of ``{"method": ..., "kwargs":
+    {...}}`` dicts, called in order) and, optionally, ``rows``, ``cols``,
+    ``width`` and ``height``.'''
+    with Plotter(spec['source'], rows=spec.get('rows', 1),
+                 cols=spec.get('cols', 1), width=spec.get('width', 1024),
+                 height=spec.get('height', 768), cache=cache) as my_plot:
+        for chart in spec['charts']:
+            getattr(my_plot, chart['method'])(**chart.get('kwargs', {}))
+        my_plot.save(spec['output'])
+    return spec['output']
+
+
+def _warm_cache(args):
+    'Parse a source into the cache; return the error (a string) or ``None``'
+    source, cache_path = args
+    try:
+        DataCache(cache_path).load(source)
+    except Exception:
+        return traceback.format_exc().strip().splitlines()[-1]
+    return None
+
+
+def _render_job(args):
+    index, spec, cache_path = args
+    start = time.time()
+    try:
+        render(spec, cache=DataCache(cache_path))
+    except Exception:
+        error = traceback.format_exc().strip().splitlines()[-1]
+    else:
+        error = None
+    return {'index': index, 'output': spec.get('output'), 'error': error,
+            'seconds': time.time() - start}
+
+
+def render_batch(specs, processes=None, cache=None):
+    '''Render a list of chart specs (see ``render``) in a process pool
+
+    The pool has ``processes`` workers (default: number of CPUs). Each
+    source is parsed once, into a ``DataCache`` (a temporary one is used if
+    ``cache`` is ``None``), and memory-mapped by the jobs that use it; if
+    a source can't be parsed, its jobs fail with that error (NumPy, Arrow
+    and SQLite sources are loaded by each job). Returns a dict with
+    ``jobs`` (one dict per spec, in order, with ``output``, ``error`` --
+    ``None`` if it worked -- and ``seconds``), ``failed``, ``seconds`` and
+    ``charts_per_second``.'''
+    import multiprocessing
+    start = time.time()
+    cache_path = cache.path if isinstance(cache, DataCache) else cache
+    temporary = cache_path is None
+    if temporary:
+        cache_path = tempfile.mkdtemp(prefix='plotter-cache-')
+    else:
+        DataCache(cache_path)
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        binary = NUMPY_EXTENSIONS + ARROW_EXTENSIONS + SQLITE_EXTENSIONS
+        sources = sorted(set(spec['source'] for spec in specs
+                             if os.path.isfile(spec.get('source', '')) and
+                             not spec['source'].lower().endswith(binary)))
+        errors = pool.map(_warm_cache, [(source, cache_path)
+                                        for source in sources])
+        errors = dict(zip(sources, errors))
+        jobs = [None] * len(specs)
+        for index, spec in enumerate(specs):
+            error = errors.get(spec.get('source'))
+            if error is not None:
+                jobs[index] = {'index': index, 'output': spec.get('output'),
+                               'error': error, 'seconds': 0.0}
+        rendered = pool.map(_render_job, [(index, spec, cache_path)
+                                          for index, spec in enumerate(specs)
+                                          if jobs[index] is None])
+        for job in rendered:
+            jobs[job['index']] = job
+    finally:
+        pool.close()
+        pool.join()
+        if temporary:
+            shutil.rmtree(cache_path, ignore_errors=True)
+    seconds = time.time() - start
+    return {'jobs': jobs,
+            'failed': len([job for job in jobs if job['error'] is not None]),
+            'seconds': seconds,
+            'charts_per_second': len(jobs) / seconds if seconds else 0.0}
+
+
+class ImageCache(object):
+    'In-memory LRU cache of rendered images (bytes), bounded by total size'
+
+    def __init__(self, max_size=64 * 1024 ** 2):
+        self.max_size = max_size
+        self.size = 0
+        self._images = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def get(self, key):
+        'Return the image cached as ``key`` (or ``None``)'
+        image = self._images.pop(key, None)
+        if image is not None:
+            self._images[key] = image
+        return image
+
+    def put(self, key, image):
+        'Cache ``image``, evicting the least recently used ones if needed'
+        if key in self._images:
+            self.size -= len(self._images.pop(key))
+        if len(image) > self.max_size:
+            return
+        self._images[key] = image
+        self.size += len(image)
+        while self.size > self.max_size:
+            self.size -= len(self._images.popitem(last=False)[1])
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m plotter',
+                                     description='Plot CSV files')
+    subparsers = parser.add_subparsers(dest='command')
+    batch_parser = subparsers.add_parser('batch',
+            help='render the chart specs in a JSON file (a list of specs)')
+    batch_parser.add_argument('specs', help='JSON file with chart specs')
+    batch_parser.add_argument('-p', '--processes', type=int, default=None,
+                              help='number of worker processes')
+    batch_parser.add_argument('--cache', default=None,
+                              help='directory to cache parsed sources')
+    serve_parser = subparsers.add_parser('serve',
+            help='serve charts of the CSV files in a directory over HTTP')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--root', default='.',
+                              help='directory with the CSV files')
+    serve_parser.add_argument('--cache-size', type=int, default=64,
+                              help='megabytes of rendered images to cache')
+    serve_parser.add_argument('--cache', default=None,
+                              help='directory to cache parsed sources')
+    args = parser.parse_args(args)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    elif args.command == 'serve':
+        from chart_server import serve
+        return serve(args.host, args.port, args.root,
+                     args.cache_size * 1024 ** 2, args.cache)
+    with io.open(args.specs, encoding='utf-8') as fp:
+        specs = json.load(fp)
+    result = render_batch(specs, processes=args.processes, cache=args.cache)
+    for job in result['jobs']:
+        if job['error'] is None:
+            print('ok     %s (%.3fs)' % (job['output'], job['seconds']))
+        else:
+            print('FAILED %s: %s' % (job['output'], job['error']))
+    print('%d charts (%d failed) in %.3fs: %.2f charts/s' % \
+          (len(result['jobs']), result['failed'], result['seconds'],
+           result['charts_per_second']))
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
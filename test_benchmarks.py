@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+
+from benchmarks import compare
+
+
+class TestCompare(unittest.TestCase):
+    def setUp(self):
+        self.baseline = {'bar': {'1000': {'call': 0.1, 'draw': 0.2,
+                                          'save': 0.0005}},
+                         'pie': {'1000': {'call': 0.1}}}
+
+    def test_slowdowns_over_the_threshold_should_be_regressions(self):
+        results = {'bar': {'1000': {'call': 0.13, 'draw': 0.22,
+                                    'save': 0.0005}},
+                   'pie': {'1000': {'call': 0.09}}}
+        self.assertEqual(compare(results, self.baseline),
+                         [('bar', 1000, 'call', 0.1, 0.13)])
+        self.assertEqual(compare(results, self.baseline, threshold=0.05),
+                         [('bar', 1000, 'call', 0.1, 0.13),
+                          ('bar', 1000, 'draw', 0.2, 0.22)])
+
+    def test_small_differences_should_be_noise(self):
+        results = {'bar': {'1000': {'save': 0.001}},  # 2x, but 0.5 ms
+                   'line': {'1000': {'call': 1.0}}}  # not in the baseline
+        self.assertEqual(compare(results, self.baseline), [])
+        self.assertEqual(compare(results, self.baseline, minimum=0.0001),
+                         [('bar', 1000, 'save', 0.0005, 0.001)])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from chart_server import ChartServer
+
+
+class TestChartServer(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, 'data.csv'), 'w') as fp:
+            fp.write('animal,legs\ndog,4\nbird,2\ncat,4\n')
+        self.server = ChartServer(self.root)
+        self.addCleanup(self.server.close)
+
+    def request(self, *queries, **headers):
+        import asyncio
+
+        async def get(port, query):
+            reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                           port)
+            lines = ['GET /chart.png?%s HTTP/1.1' % query]
+            lines.extend('%s: %s' % item for item in headers.items())
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+            response = await reader.read()
+            writer.close()
+            head, body = response.split(b'\r\n\r\n', 1)
+            head = head.decode('latin-1').split('\r\n')
+            response_headers = dict(line.split(': ', 1) for line in head[1:])
+            return int(head[0].split()[1]), response_headers, body
+
+        async def run():
+            server = await self.server.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await asyncio.gather(*[get(port, query)
+                                              for query in queries])
+            finally:
+                server.close()
+                await server.wait_closed()
+        return asyncio.run(run())
+
+    def test_identical_requests_should_be_rendered_once(self):
+        query = 'source=data.csv&method=bar&kwargs={"count":"animal"}'
+        responses = self.request(*[query] * 5)
+        self.assertEqual(self.server.renders, 1)
+        self.assertEqual(set(status for status, headers, body in responses),
+                         {200})
+        status, headers, body = responses[0]
+        self.assertTrue(body.startswith(b'\x89PNG'))
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        same_kwargs = 'source=data.csv&method=bar&' \
+                      'kwargs={%20"count":+"animal"}'
+        status, headers_2, body_2 = self.request(same_kwargs)[0]
+        self.assertEqual((headers_2['ETag'], body_2), (headers['ETag'], body))
+        self.assertEqual(self.server.renders, 1)
+        status, headers_3, body_3 = self.request(
+                query, **{'If-None-Match': headers['ETag']})[0]
+        self.assertEqual((status, body_3), (304, b''))
+        self.assertEqual(self.server.renders, 1)
+
+    def test_changing_the_source_should_change_the_etag(self):
+        query = 'source=data.csv&method=pie&kwargs={"values_column":"legs",' \
+                '"labels_column":"animal"}'
+        etag = self.request(query)[0][1]['ETag']
+        with open(os.path.join(self.root, 'data.csv'), 'a') as fp:
+            fp.write('ant,6\n')
+        self.assertNotEqual(self.request(query)[0][1]['ETag'], etag)
+        self.assertEqual(self.server.renders, 2)
+
+    def test_bad_requests(self):
+        statuses = [status for status, headers, body in self.request(
+                'source=data.csv&method=plot',
+                'source=../data.csv&method=bar',
+                'source=missing.csv&method=bar',
+                'source=data.csv&method=bar&kwargs={"count":"missing"}')]
+        self.assertEqual(statuses, [400, 400, 404, 400])
+
+    def test_links_should_not_escape_the_root(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        with open(os.path.join(outside, 'secret.csv'), 'w') as fp:
+            fp.write('animal,legs\ndog,4\n')
+        os.symlink(os.path.join(outside, 'secret.csv'),
+                   os.path.join(self.root, 'link.csv'))
+        os.symlink(os.path.join(self.root, 'data.csv'),
+                   os.path.join(self.root, 'data_link.csv'))
+        statuses = [status for status, headers, body in self.request(
+                'source=link.csv&method=bar&kwargs={"count":"animal"}',
+                'source=data_link.csv&method=bar&kwargs={"count":"animal"}')]
+        self.assertEqual(statuses, [400, 200])
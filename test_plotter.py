@@ -2,12 +2,28 @@
 # coding: utf-8
 
 import unittest
+import collections
+import datetime
+import json
 import os
 import shutil
 import tempfile
 import inspect
+import io
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+import subprocess
+import sys
 from textwrap import dedent
-from plotter import Plotter
+import numpy
+from plotter import (Plotter, ColumnStore, group_reduce, StreamingAggregate,
+                     CsvStream, downsample_indexes, DataCache, render_batch,
+                     main, Stats, density_grid,
+                     HeavyHitters, time_buckets, SchemaError,
+                     sample_types, SqliteSource, minmax_pyramid,
+                     _split_style, _argsort)
 
 
 TEST_RESULTS_PATH = 'test_results'
@@ -18,7 +34,7 @@ except OSError:
 os.mkdir(TEST_RESULTS_PATH)
 
 def create_temp_csv(contents):
-    temp_fp = tempfile.NamedTemporaryFile(delete=False)
+    temp_fp = tempfile.NamedTemporaryFile(mode='w', delete=False)
     temp_fp.write(contents)
     temp_fp.close()
     return temp_fp.name
@@ -294,6 +310,120 @@ class TestCsvPlot(unittest.TestCase):
         my_plot.bar(count='year', x_rotation=45, title='Bar plot')
         my_plot.save(image_filename)
 
+    def test_14_bar_plot_with_aggregate(self):
+        image_filename = get_filename_from_frame(inspect.currentframe())
+        my_plot = Plotter(self.data['bar-data'])
+        my_plot.bar(x_column='year', y_columns=['quantity'], aggregate='mean',
+                    title='Mean quantity by year')
+        my_plot.save(image_filename)
+
+    def test_streaming_should_render_the_same_image(self):
+        images = []
+        for streaming in (False, True):
+            my_plot = Plotter(self.data['bar-data'], rows=2, cols=2,
+                              streaming=streaming, chunk_size=4)
+            my_plot.stacked_bar(x_column='year', y_column='quantity',
+                                y_labels='product_name')
+            my_plot.radar(axis_labels='product_name', values='quantity',
+                          legends_column='year')
+            my_plot.bar(count='year')
+            my_plot.pie(values_column='quantity', labels_column='year')
+            image = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+            image.close()
+            my_plot.save(image.name)
+            with open(image.name, 'rb') as fp:
+                images.append(fp.read())
+            os.remove(image.name)
+        self.assertEqual(images[0], images[1])
+
+    def test_17_downsampled_linear_and_scatter(self):
+        image_filename = get_filename_from_frame(inspect.currentframe())
+        rows = ['day,value,other'] + \
+               ['2011-01-%02d,%d,%d' % (i % 28 + 1, (i * 37) % 101, i % 13)
+                for i in range(1000)]
+        filename = create_temp_csv('\n'.join(rows))
+        self.addCleanup(os.remove, filename)
+        my_plot = Plotter(filename, rows=2, cols=1, width=80)
+        my_plot.linear(ignore=['day'], downsample='minmax')
+        my_plot.scatter(x_column='day', downsample='lttb')
+        linear_axes, scatter_axes = my_plot.fig.axes
+        self.assertEqual(len(linear_axes.lines), 2)
+        self.assertEqual(len(scatter_axes.lines), 2)
+        for line in linear_axes.lines:  # minimum and maximum per pixel
+            self.assertLessEqual(len(line.get_xdata()), 2 * 80)
+        for line in scatter_axes.lines:
+            self.assertEqual(len(line.get_xdata()), 80)
+        my_plot.save(image_filename)
+
+    def test_18_batch_rendering(self):
+        image_filename = get_filename_from_frame(inspect.currentframe())
+        specs = [{'source': self.data['bar-data'], 'output': image_filename,
+                  'rows': 1, 'cols': 2,
+                  'charts': [{'method': 'bar', 'kwargs': {'count': 'year'}},
+                             {'method': 'pie',
+                              'kwargs': {'values_column': 'quantity',
+                                         'labels_column': 'product_name'}}]},
+                 {'source': self.data['bar-data'],
+                  'output': image_filename.replace('.png', '_2.png'),
+                  'charts': [{'method': 'stacked_bar',
+                              'kwargs': {'x_column': 'year',
+                                         'y_column': 'quantity',
+                                         'y_labels': 'product_name'}}]},
+                 {'source': self.data['bar-data'],
+                  'output': image_filename.replace('.png', '_3.png'),
+                  'charts': [{'method': 'bar',
+                              'kwargs': {'count': 'no such column'}}]}]
+        result = render_batch(specs, processes=2)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual([job['error'] is None for job in result['jobs']],
+                         [True, True, False])
+        self.assertTrue(os.path.exists(specs[0]['output']))
+        self.assertTrue(os.path.exists(specs[1]['output']))
+        self.assertFalse(os.path.exists(specs[2]['output']))
+        self.assertTrue(result['charts_per_second'] > 0)
+
+        specs_filename = create_temp_csv(json.dumps(specs[:2]))
+        self.addCleanup(os.remove, specs_filename)
+        self.assertEqual(main(['batch', specs_filename, '-p', '1']), 0)
+
+    def test_18_batch_should_report_bad_sources_per_job(self):
+        image_filename = get_filename_from_frame(inspect.currentframe())
+        bad_source = create_temp_csv('')
+        self.addCleanup(os.remove, bad_source)
+        with open(bad_source, 'wb') as fp:
+            fp.write(b'name,legs\n\xff\xfe,4\n')
+        chart = {'method': 'bar', 'kwargs': {'count': 'year'}}
+        specs = [{'source': bad_source, 'output': image_filename,
+                  'charts': [chart]},
+                 {'source': self.data['bar-data'],
+                  'output': image_filename.replace('.png', '_2.png'),
+                  'charts': [chart]}]
+        result = render_batch(specs, processes=2)
+        self.assertEqual(result['failed'], 1)
+        self.assertIn('UnicodeDecodeError', result['jobs'][0]['error'])
+        self.assertIsNone(result['jobs'][1]['error'])
+        self.assertTrue(os.path.exists(specs[1]['output']))
+
+    def test_18_batch_should_load_npy_sources_in_jobs(self):
+        image_filename = get_filename_from_frame(inspect.currentframe())
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        records = numpy.zeros(10, dtype=[('x', 'int32'), ('y', 'float64')])
+        records['x'] = numpy.arange(10)
+        records['y'] = numpy.arange(10) ** 2
+        npy = os.path.join(temp_dir, 'data.npy')
+        numpy.save(npy, records)
+        specs = [{'source': npy, 'output': image_filename,
+                  'charts': [{'method': 'linear',
+                              'kwargs': {'ignore': ['x']}}]},
+                 {'source': self.data['bar-data'],
+                  'output': image_filename.replace('.png', '_2.png'),
+                  'charts': [{'method': 'bar', 'kwargs': {'count': 'year'}}]}]
+        result = render_batch(specs, processes=2)
+        self.assertEqual([job['error'] for job in result['jobs']],
+                         [None, None])
+        self.assertTrue(os.path.exists(specs[0]['output']))
+
     def test_should_raises_OverflowError_when_exceed_number_of_subplots(self):
         my_plot = Plotter(self.data['bar-data'], rows=2, cols=1)
         my_plot.linear(ignore=['product_name', 'year'])
@@ -305,5 +435,1010 @@ class TestCsvPlot(unittest.TestCase):
         image_filename = get_filename_from_frame(inspect.currentframe())
         my_plot = Plotter(self.data['bar-data'])
         my_plot.radar(axis_labels='product_name', values='quantity',
-                      legends='year', title='Products by year')
+                      legends_column='year', legends=True,
+                      title='Products by year')
         my_plot.save(image_filename)
+
+
+class TestColumnStore(unittest.TestCase):
+    def setUp(self):
+        file_contents = dedent('''
+        "name","quantity","price","day","moment"
+        dog,1,1.5,2011-01-01,2011-01-01 10:00:00
+        cat,2,2.5,2011-01-02,2011-01-01 11:00:00
+        dog,3,,2011-01-03,2011-01-01 12:00:00
+        ''')
+        self.filename = create_temp_csv(file_contents)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_should_identify_column_types(self):
+        store = ColumnStore.from_csv(self.filename)
+        self.assertEqual(store.headers,
+                         ['name', 'quantity', 'price', 'day', 'moment'])
+        self.assertEqual(store.types, {'name': str, 'quantity': int,
+                                       'price': float, 'day': datetime.date,
+                                       'moment': datetime.datetime})
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store['quantity'].dtype.name, 'int64')
+        self.assertEqual(store['day'].dtype.name, 'datetime64[D]')
+        self.assertTrue(numpy.isnan(store['price'][2]))
+
+    def test_text_columns_should_be_dictionary_encoded(self):
+        store = ColumnStore.from_csv(self.filename)
+        codes, categories = store.codes('name')
+        self.assertEqual(list(categories), ['cat', 'dog'])
+        self.assertEqual(list(codes), [1, 0, 1])
+        self.assertEqual(list(store['name']), ['dog', 'cat', 'dog'])
+        self.assertEqual(store.labels('moment')[0], '2011-01-01 10:00:00')
+
+    def test_chunks_should_get_the_types_of_the_whole_file(self):
+        rows = ['code,count,day,note'] + \
+               ['%02d,%d,2011-01-%02d,' % (i, i, i + 1) for i in range(4)] + \
+               ['AB,,,'] + ['%02d,%d,,x' % (i, i) for i in range(3)]
+        filename = create_temp_csv('\n'.join(rows) + '\n')
+        self.addCleanup(os.remove, filename)
+        whole = ColumnStore.from_csv(filename, chunk_size=None)
+        store = ColumnStore.from_csv(filename, chunk_size=2)
+        self.assertEqual(store.types, {'code': str, 'count': float,
+                                       'day': datetime.date, 'note': str})
+        self.assertEqual(store.types, whole.types)
+        for header in store.headers:
+            self.assertEqual(list(store[header].astype('U')),
+                             list(whole[header].astype('U')))
+        self.assertEqual(list(store['code'][:2]), ['00', '01'])
+        self.assertEqual(list(store.codes('note')[1]), ['', 'x'])
+
+    def test_should_load_outputty_like_tables(self):
+        class FakeTable(object):
+            headers = ['animal', 'legs']
+            types = {'animal': str, 'legs': int}
+            _columns = {'animal': ['dog', 'bird'], 'legs': [4, 2]}
+
+            def __getitem__(self, header):
+                return self._columns[header]
+
+        my_plot = Plotter(FakeTable())
+        self.assertEqual(my_plot.data.types, {'animal': str, 'legs': int})
+        self.assertEqual(list(my_plot.data['legs']), [4, 2])
+        self.assertEqual(list(my_plot.data['animal']), ['dog', 'bird'])
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        rows = ['id,price,day,name'] + \
+               ['%d,%d.5,2011-01-%02d,item %d' % (i, i, i % 28 + 1, i)
+                for i in range(3000)]
+        self.filename = create_temp_csv('\n'.join(rows) + '\n')
+        self.addCleanup(os.remove, self.filename)
+
+    def test_schema_should_read_only_its_columns(self):
+        store = ColumnStore.from_csv(self.filename,
+                                     schema={'price': float, 'day': 'date'})
+        self.assertEqual(store.headers, ['price', 'day'])
+        self.assertEqual(store.types, {'price': float, 'day': datetime.date})
+        self.assertEqual(store['price'][1], 1.5)
+        stream = CsvStream(self.filename, schema={'id': 'int'})
+        self.assertEqual(stream.headers, ['id'])
+        self.assertEqual(stream['id'].sum(), sum(range(3000)))
+        with self.assertRaises(SchemaError):
+            ColumnStore.from_csv(self.filename, schema={'missing': int})
+        with self.assertRaises(SchemaError):
+            ColumnStore.from_csv(self.filename, schema={'id': 'decimal'})
+
+    def test_mismatches_should_raise_schema_error(self):
+        with open(self.filename, 'a') as fp:
+            fp.write('oops,1.5,2011-01-01,last\n')
+        with self.assertRaises(SchemaError) as context:
+            ColumnStore.from_csv(self.filename, schema={'id': int})
+        self.assertIn("'oops' (row 3001)", str(context.exception))
+        self.assertTrue(issubclass(SchemaError, ValueError))
+        types = sample_types(self.filename, sample_size=10)
+        self.assertEqual(types, {'id': int, 'price': float,
+                                 'day': datetime.date, 'name': str})
+        with self.assertRaises(SchemaError):
+            Plotter(self.filename, sample_size=10)
+        stream = CsvStream(self.filename, chunk_size=10)
+        self.assertEqual(stream.types['id'], int)
+        with self.assertRaises(SchemaError) as context:
+            stream.aggregate(['name'], 'id')
+        self.assertIn("'oops' (row 3001) is not a valid int (in chunk 301",
+                      str(context.exception))
+        store = ColumnStore.from_csv(self.filename)  # full detection
+        self.assertEqual(store.types['id'], str)
+
+
+def is_memory_mapped(array):
+    import mmap
+    while array is not None:
+        if isinstance(array, mmap.mmap):
+            return True
+        if getattr(array, '_mmap', None) is not None:
+            array = array._mmap
+        else:
+            array = getattr(array, 'base', None)
+    return False
+
+
+class TestArrays(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.x = numpy.arange(1000, dtype='int32')
+        self.y = numpy.sin(self.x / 10.0)
+        self.day = numpy.datetime64('2011-01-01') + \
+                   self.x.astype('timedelta64[D]')
+
+    def test_should_use_arrays_without_copying(self):
+        names = numpy.array(['dog', 'cat'] * 500)
+        my_plot = Plotter({'x': self.x, 'y': self.y, 'day': self.day,
+                           'name': names})
+        store = my_plot.data
+        self.assertEqual(store.headers, ['x', 'y', 'day', 'name'])
+        self.assertEqual(store.types, {'x': int, 'y': float,
+                                       'day': datetime.date, 'name': str})
+        self.assertIs(store['y'], self.y)
+        self.assertEqual(list(store.codes('name')[1]), ['cat', 'dog'])
+        matrix = numpy.column_stack([self.y, self.y * 2])
+        store = Plotter(matrix).data
+        self.assertEqual(store.headers, ['0', '1'])
+        self.assertTrue(numpy.shares_memory(store['1'], matrix))
+        with self.assertRaises(ValueError):
+            ColumnStore.from_arrays({'x': self.x, 'y': self.y[:10]})
+
+    def test_npy_and_npz_should_be_memory_mapped(self):
+        records = numpy.zeros(1000, dtype=[('x', 'int32'), ('y', 'float64')])
+        records['x'], records['y'] = self.x, self.y
+        npy = os.path.join(self.temp_dir, 'data.npy')
+        numpy.save(npy, records)
+        npz = os.path.join(self.temp_dir, 'data.npz')
+        numpy.savez(npz, x=self.x, y=self.y, day=self.day)
+        compressed = os.path.join(self.temp_dir, 'compressed.npz')
+        numpy.savez_compressed(compressed, x=self.x, y=self.y)
+        for filename in (npy, npz, compressed):
+            my_plot = Plotter(filename)
+            my_plot.linear(ignore=['x'], style='-')
+            numpy.testing.assert_array_equal(my_plot.data['y'], self.y)
+            numpy.testing.assert_array_equal(my_plot.data['x'], self.x)
+            self.assertEqual(is_memory_mapped(my_plot.data['y']),
+                             filename != compressed)
+        store = ColumnStore.from_npy(npz)
+        self.assertEqual(store.types['day'], datetime.date)
+        numpy.testing.assert_array_equal(store['day'], self.day)
+
+    def test_arrow_ipc_should_be_memory_mapped(self):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        table = pyarrow.table({'y': self.y, 'name': ['dog', None] * 500,
+                               'legs': pyarrow.array([4, None] * 500)})
+        filename = os.path.join(self.temp_dir, 'data.arrow')
+        with pyarrow.ipc.new_file(filename, table.schema) as writer:
+            writer.write_table(table)
+        store = Plotter(filename).data
+        self.assertEqual(store.types, {'y': float, 'name': str,
+                                       'legs': float})
+        self.assertFalse(store['y'].flags.owndata)  # a view of the file
+        self.assertEqual(list(store['name'][:2]), ['dog', ''])
+        self.assertTrue(numpy.isnan(store['legs'][1]))
+
+
+class TestSqlite(unittest.TestCase):
+    def setUp(self):
+        import sqlite3
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.filename = os.path.join(self.temp_dir, 'data.db')
+        random = numpy.random.RandomState(1)
+        self.store = ColumnStore()
+        self.store.add_column('animal', numpy.array(['dog', 'cat', 'bird'])[
+                random.randint(0, 3, 1000)], str)
+        self.store.add_column('year', random.randint(2000, 2005, 1000), int)
+        self.store.add_column('weight', random.normal(10, 2, 1000), float)
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE pets (animal TEXT, year INTEGER, '
+                           'weight REAL, "first day" DATE, untyped)')
+        connection.executemany('INSERT INTO pets VALUES (?, ?, ?, ?, ?)',
+                [(animal, int(year), float(weight), '2011-01-%02d' % (day + 1),
+                  day) for day, (animal, year, weight) in enumerate(zip(
+                        self.store['animal'], self.store['year'],
+                        self.store['weight'])) if day < 31] +
+                [(animal, int(year), float(weight), None, None)
+                 for animal, year, weight in zip(self.store['animal'][31:],
+                                                 self.store['year'][31:],
+                                                 self.store['weight'][31:])])
+        connection.commit()
+        connection.close()
+
+    def test_aggregations_should_be_computed_by_sqlite(self):
+        source = SqliteSource(self.filename)
+        queries = []
+        source.connection.set_trace_callback(queries.append)
+        self.assertEqual(source.table, 'pets')
+        self.assertEqual(len(source), 1000)
+        for how in ('sum', 'count', 'mean', 'min', 'max'):
+            categories, result = source.aggregate(['animal', 'year'],
+                                                  'weight', how)
+            expected_categories, expected = self.store.aggregate(
+                    ['animal', 'year'], 'weight', how)
+            for values, expected_values in zip(categories,
+                                               expected_categories):
+                numpy.testing.assert_array_equal(values, expected_values)
+            numpy.testing.assert_allclose(result, expected)
+            self.assertIn('GROUP BY', queries[-1])
+        categories, result = source.aggregate(['year'], 'year')
+        self.assertEqual(result.dtype, numpy.int64)
+        values, counts, error, total = source.top_k('animal', 2)
+        expected = self.store.top_k('animal', 2)
+        numpy.testing.assert_array_equal(values, expected[0])
+        numpy.testing.assert_array_equal(counts, expected[1])
+        self.assertEqual((error, total), (0, 1000))
+        numpy.testing.assert_allclose(source['weight'], self.store['weight'])
+        self.assertEqual(queries[-1], 'SELECT "weight" FROM "pets"')
+        with self.assertRaises(KeyError):
+            source['missing']
+
+    def test_types_should_be_declared_or_sampled(self):
+        source = SqliteSource(self.filename, 'pets', sample_size=10)
+        self.assertEqual(source.types, {'animal': str, 'year': int,
+                                        'weight': float,
+                                        'first day': datetime.date,
+                                        'untyped': int})
+        self.assertEqual(source['first day'][0], numpy.datetime64('2011-01-01'))
+        self.assertTrue(numpy.isnat(source['first day'][-1]))
+        self.assertTrue(numpy.isnan(source['untyped'][-1]))
+        with self.assertRaises(ValueError):
+            SqliteSource(self.filename, 'missing')
+
+    def test_should_plot_from_sqlite_files(self):
+        my_plot = Plotter(self.filename, rows=3, cols=2, table='pets')
+        self.assertIsInstance(my_plot.data, SqliteSource)
+        my_plot.stacked_bar('year', 'weight', 'animal')
+        my_plot.radar('year', 'weight', 'animal')
+        my_plot.bar(count='animal')
+        my_plot.pie('weight', 'animal')
+        my_plot.linear(ignore=['untyped'], style='-')
+        my_plot.scatter('year', ignore=['untyped'], order_by='year',
+                        downsample='minmax')
+        numpy.testing.assert_array_equal(my_plot.data['year'],
+                                         self.store['year'])
+        my_plot.save(get_filename_from_frame(inspect.currentframe()))
+
+    def test_forked_processes_should_open_their_own_connection(self):
+        import sqlite3
+        source = SqliteSource(sqlite3.connect(self.filename))
+        inherited = source.connection
+        self.assertIs(source.connection, inherited)
+        source._pid = -1  # as in a forked worker
+        self.assertIsNot(source.connection, inherited)
+        self.assertEqual(len(source), 1000)
+        self.assertIs(source.connection, source.connection)
+
+    def test_sort_indexes_should_be_computed_by_sqlite(self):
+        source = SqliteSource(self.filename)
+        queries = []
+        source.connection.set_trace_callback(queries.append)
+        for header in ('animal', 'year', 'weight'):
+            for ordering in ('asc', 'desc'):
+                self.assertEqual(source.sort_index(header, ordering).tolist(),
+                                 self.store.sort_index(header,
+                                                       ordering).tolist())
+                self.assertIn('ORDER BY', queries[-1])
+        for header in ('first day', 'untyped'):  # with NULLs
+            for ordering in ('asc', 'desc'):
+                self.assertEqual(source.sort_index(header, ordering).tolist(),
+                                 _argsort(source[header],
+                                          ordering == 'desc').tolist())
+
+
+class TestAggregate(unittest.TestCase):
+    def test_group_reduce(self):
+        index = numpy.array([0, 2, 0, 2, 2])
+        values = numpy.array([1, 2, 3, 4, 5])
+        self.assertEqual(list(group_reduce(index, 3, values, 'sum')),
+                         [4, 0, 11])
+        self.assertEqual(list(group_reduce(index, 3, how='count')),
+                         [2, 0, 3])
+        result = group_reduce(index, 3, values, 'mean')
+        self.assertEqual((result[0], result[2]), (2.0, 11 / 3.0))
+        self.assertTrue(numpy.isnan(result[1]))
+        self.assertEqual(list(group_reduce(index, 3, values, 'min')[::2]),
+                         [1, 2])
+        self.assertEqual(list(group_reduce(index, 3, values, 'max')[::2]),
+                         [3, 5])
+        with self.assertRaises(ValueError):
+            group_reduce(index, 3, values, 'median')
+
+    def test_group_reduce_should_sum_big_integers_exactly(self):
+        values = numpy.array([2 ** 53, 1, 2 ** 62, 3], dtype='int64')
+        result = group_reduce(numpy.array([0, 0, 1, 1]), 2, values, 'sum')
+        self.assertEqual(result.dtype, numpy.int64)
+        self.assertEqual(result.tolist(), [2 ** 53 + 1, 2 ** 62 + 3])
+
+    def test_group_reduce_should_not_warn_about_nan(self):
+        import warnings
+        index = numpy.array([0, 0, 1])
+        values = numpy.array([1.0, numpy.nan, 2.0])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            for how in ('min', 'max'):
+                result = group_reduce(index, 2, values, how)
+                self.assertTrue(numpy.isnan(result[0]))
+                self.assertEqual(result[1], 2.0)
+
+    def test_aggregate_by_two_keys(self):
+        store = ColumnStore()
+        store.add_column('product', numpy.array(['b', 'a', 'b', 'a']), str)
+        store.add_column('year', numpy.array([2001, 2000, 2000, 2000]), int)
+        store.add_column('quantity', numpy.array([1, 2, 3, 4]), int)
+        categories, result = store.aggregate(['product', 'year'], 'quantity')
+        self.assertEqual(list(categories[0]), ['a', 'b'])
+        self.assertEqual(list(categories[1]), [2000, 2001])
+        self.assertEqual(result.tolist(), [[6, 0], [3, 1]])
+
+    def test_streaming_aggregate_should_merge_chunks(self):
+        aggregator = StreamingAggregate('sum')
+        aggregator.update([numpy.array(['2', '1', '2'])],
+                          numpy.array([1, 2, 3]))
+        aggregator.update([numpy.array(['1.5', '1.0'])],
+                          numpy.array([4.0, 5.0]))
+        (categories, ), result = aggregator.result()
+        self.assertEqual(list(categories), [1.0, 1.5, 2.0])
+        self.assertEqual(list(result), [7.0, 4.0, 4.0])
+
+    def test_csv_stream_aggregate_should_match_column_store(self):
+        file_contents = dedent('''
+        animal,legs
+        dog,4
+        bird,2
+        dog,3
+        snake,
+        ''')
+        filename = create_temp_csv(file_contents)
+        self.addCleanup(os.remove, filename)
+        stream = CsvStream(filename, chunk_size=1)
+        store = ColumnStore.from_csv(filename)
+        for how in ('count', 'min', 'max'):
+            expected = store.aggregate(['animal'], 'legs', how)
+            result = stream.aggregate(['animal'], 'legs', how)
+            self.assertEqual(list(result[0][0]), list(expected[0][0]))
+            numpy.testing.assert_equal(result[1], expected[1])
+
+
+class TestHeavyHitters(unittest.TestCase):
+    def test_sketch_should_bound_memory_and_errors(self):
+        random = numpy.random.RandomState(0)
+        keys = numpy.array(['user-%d' % key
+                            for key in random.zipf(1.5, 50000)])
+        sketch = HeavyHitters(capacity=100)
+        for start in range(0, len(keys), 1000):
+            sketch.update(keys[start:start + 1000])
+            self.assertLessEqual(len(sketch._keys), 100)
+        self.assertEqual(sketch.total, 50000)
+        self.assertLessEqual(sketch.error, 50000 / 101.0)
+        exact_keys, exact_counts = numpy.unique(keys, return_counts=True)
+        exact = dict(zip(exact_keys.tolist(), exact_counts.tolist()))
+        top_keys, top_counts = sketch.result(5)
+        order = numpy.argsort(-exact_counts, kind='mergesort')[:5]
+        self.assertEqual(top_keys.tolist(), exact_keys[order].tolist())
+        for key, count in zip(top_keys.tolist(), top_counts.tolist()):
+            self.assertTrue(count <= exact[key] <= count + sketch.error)
+
+    def test_bar_top_k_with_other(self):
+        rows = ['page'] + ['/a'] * 50 + ['/b'] * 30 + ['/c'] * 20 + \
+               ['/%d' % number for number in range(100)]
+        filename = create_temp_csv('\n'.join(rows))
+        self.addCleanup(os.remove, filename)
+        for streaming in (False, True):
+            my_plot = Plotter(filename, streaming=streaming, chunk_size=16)
+            my_plot.bar(count='page', top_k=3, other=True, sketch_size=8)
+            subplot = my_plot.fig.axes[0]
+            self.assertEqual([label.get_text()
+                              for label in subplot.get_xticklabels()],
+                             ['/a', '/b', '/c', 'Other'])
+            heights = [patch.get_height() for patch in subplot.patches]
+            self.assertEqual(sum(heights), 200)
+            legend = subplot.get_legend().get_texts()[0].get_text()
+            if streaming:
+                self.assertIn('too low', legend)
+            else:
+                self.assertEqual(heights, [50, 30, 20, 100])
+                self.assertEqual(legend, 'page')
+
+
+class TestDownsample(unittest.TestCase):
+    def setUp(self):
+        self.y = numpy.sin(numpy.arange(10000) / 100.0)
+        self.y[1234] = 10
+        self.y[5678] = -10
+
+    def test_minmax_should_keep_peaks_and_valleys(self):
+        indexes = downsample_indexes(self.y, 100)
+        self.assertTrue(len(indexes) <= 202)
+        self.assertEqual((indexes[0], indexes[-1]), (0, 9999))
+        self.assertIn(1234, indexes)
+        self.assertIn(5678, indexes)
+
+    def test_lttb_should_return_number_of_buckets_points(self):
+        indexes = downsample_indexes(self.y, 100, 'lttb')
+        self.assertEqual(len(indexes), 100)
+        self.assertIn(1234, indexes)
+        self.assertTrue((numpy.diff(indexes) > 0).all())
+
+    def test_small_series_should_not_be_downsampled(self):
+        self.assertEqual(list(downsample_indexes(self.y[:10], 100)),
+                         list(range(10)))
+        with self.assertRaises(ValueError):
+            downsample_indexes(self.y, 100, 'average')
+
+
+class TestOrderBy(unittest.TestCase):
+    def test_scatter_should_sort_once_without_changing_the_data(self):
+        random = numpy.random.RandomState(3)
+        x = random.permutation(100)
+        y = x * 2.0
+        names = numpy.array(['dog', 'cat', 'bird', 'ant'])[x % 4]
+        store = ColumnStore()
+        store.add_column('x', x, int)
+        store.add_column('y', y, float)
+        store.add_column('name', names, str)
+        my_plot = Plotter(store, rows=4, cols=4)
+        for index in range(16):
+            my_plot.scatter('name', ignore=['x'], legends=None,
+                            order_by='x' if index < 14 else 'name',
+                            ordering='desc' if index % 2 else 'asc',
+                            downsample='minmax' if index == 13 else None,
+                            density=index == 12)
+        self.assertIs(store['x'], x)
+        self.assertIs(my_plot._sort_index('x'), my_plot._sort_index('x'))
+        self.assertEqual(len(my_plot._sort_indexes), 4)
+        axes = my_plot.fig.axes
+        self.assertEqual(list(axes[0].lines[0].get_ydata()),
+                         list(numpy.arange(100) * 2.0))
+        self.assertEqual(list(axes[1].lines[0].get_ydata()),
+                         list(numpy.arange(99, -1, -1) * 2.0))
+        self.assertEqual(axes[0].get_xticklabels()[0].get_text(), 'dog')
+        self.assertEqual(axes[-2].get_xticklabels()[0].get_text(), 'ant')
+        self.assertEqual(axes[-1].get_xticklabels()[0].get_text(), 'dog')
+        my_plot.save(get_filename_from_frame(inspect.currentframe()))
+
+
+    def test_descending_sorts_should_be_stable(self):
+        store = ColumnStore()
+        store.add_column('legs', numpy.array([4, 2, 4, 6, 2]), int)
+        store.add_column('name', numpy.array(['dog', 'bird', 'cat', 'ant',
+                                              'emu']), str)
+        my_plot = Plotter(store)
+        self.assertEqual(my_plot._sort_index('legs', 'desc').tolist(),
+                         [3, 0, 2, 1, 4])
+        self.assertEqual(my_plot._sort_index('legs').tolist(),
+                         [1, 4, 0, 2, 3])
+        self.assertEqual(store.sort_index('name', 'desc').tolist(),
+                         [4, 0, 2, 1, 3])
+
+class TestResample(unittest.TestCase):
+    def test_time_buckets(self):
+        dates = numpy.array(['2024-01-03T10:30', '2024-01-07T23:59',
+                             '2024-01-08T00:00', '2024-02-29T12:00'],
+                            dtype='M8[s]')
+        index, starts = time_buckets(dates, '1W')
+        self.assertEqual(index.tolist(), [0, 0, 1, 8])
+        self.assertEqual(str(starts[0]), '2024-01-01')  # a Monday
+        self.assertEqual(len(starts), 9)
+        index, starts = time_buckets(dates, '1M')
+        self.assertEqual(index.tolist(), [0, 0, 0, 1])
+        index, starts = time_buckets(dates[:1], '6H')
+        self.assertEqual(str(starts[0]), '2024-01-03T06')
+        for rule in ('1X', '0D', 'D1'):
+            with self.assertRaises(ValueError):
+                time_buckets(dates, rule)
+
+    def test_scatter_points_should_depend_on_the_time_range(self):
+        store = ColumnStore()
+        minutes = numpy.arange(0, 10 * 24 * 60, 2).astype('m8[m]')
+        store.add_column('when', numpy.datetime64('2024-01-01T00:00') +
+                                 minutes, datetime.datetime)
+        store.add_column('value', numpy.ones(len(minutes)), float)
+        my_plot = Plotter(store, rows=3)
+        my_plot.scatter('when', resample='1D', resample_how='sum',
+                        legends=None)
+        my_plot.linear(x_labels='when', resample='12H', resample_how='band')
+        scatter, linear = my_plot.fig.axes
+        self.assertEqual(len(scatter.collections), 0)
+        self.assertEqual(scatter.lines[0].get_ydata().tolist(), [720] * 10)
+        self.assertEqual(len(linear.lines[0].get_xdata()), 20)
+        self.assertEqual(len(linear.collections), 1)  # min/max band
+        with self.assertRaises(ValueError):
+            my_plot.linear(resample='1D')
+
+
+class TestDensity(unittest.TestCase):
+    def test_density_grid_should_bin_chunks_with_fixed_edges(self):
+        chunks = [(numpy.array([0, 1, 9.9]), numpy.array([0, 0, 9.9])),
+                  (numpy.array([10, 5, numpy.nan, 11]),
+                   numpy.array([10, 5, 1, 1]))]
+        grid = density_grid(chunks, (2, 2), (0, 10), (0, 10))
+        self.assertEqual(grid.tolist(), [[2, 0], [0, 3]])
+
+    def test_streaming_density_should_match_column_store(self):
+        rows = ['x,y,z'] + ['%d,%d,%s' % (x, x % 7, x % 3 or '')
+                            for x in range(500)]
+        filename = create_temp_csv('\n'.join(rows))
+        self.addCleanup(os.remove, filename)
+        images = []
+        for streaming in (False, True):
+            my_plot = Plotter(filename, streaming=streaming, chunk_size=64,
+                              width=200, height=100)
+            my_plot.scatter(x_column='x', density=2)
+            image = my_plot.fig.axes[0].images[0].get_array()
+            self.assertEqual(image.sum(), 500 + 333)
+            images.append(image)
+            my_plot.close()
+        numpy.testing.assert_array_equal(images[0], images[1])
+
+
+    def test_streaming_density_should_read_only_the_tick_labels(self):
+        class ColumnsForbidden(CsvStream):
+            def __getitem__(self, header):
+                raise AssertionError('read the whole %r column' % header)
+
+        rows = ['day,y'] + ['2011-01-%02d,%d' % (x % 28 + 1, x)
+                            for x in range(500)]
+        filename = create_temp_csv('\n'.join(rows))
+        self.addCleanup(os.remove, filename)
+        tick_labels = []
+        for data in (ColumnStore.from_csv(filename),
+                     ColumnsForbidden(filename, chunk_size=64)):
+            my_plot = Plotter(width=200, height=100)
+            my_plot.data = data
+            my_plot.scatter(x_column='day', density=2)
+            my_plot.fig.canvas.draw()
+            tick_labels.append([label.get_text() for label in
+                                my_plot.fig.axes[0].get_xticklabels()])
+            my_plot.close()
+        self.assertIn(u'2011-01-04', tick_labels[0])
+        self.assertEqual(tick_labels[0], tick_labels[1])
+
+class TestTiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_minmax_pyramid(self):
+        pyramid = minmax_pyramid(numpy.arange(10), 3)
+        self.assertEqual([len(lows) for lows, highs in pyramid], [3, 5, 10])
+        self.assertEqual(pyramid[0][0].tolist(), [0, 4, 8])
+        self.assertEqual(pyramid[0][1].tolist(), [3, 7, 9])
+        self.assertEqual(pyramid[1][1].tolist(), [1, 3, 5, 7, 9])
+        self.assertEqual(pyramid[2][0].tolist(), list(range(10)))
+
+    def test_export_tiles_should_render_only_tiles_with_new_rows(self):
+        from matplotlib.image import imread
+        day = numpy.datetime64('2011-01-01') + numpy.arange(1000)
+        my_plot = Plotter({'day': day, 'value': numpy.sin(numpy.arange(1000) /
+                                                          50.0)})
+        rendered = my_plot.export_tiles(self.directory, x_column='day',
+                                        tile_size=64, processes=2)
+        with open(os.path.join(self.directory, 'manifest.json')) as fp:
+            manifest = json.load(fp)
+        self.assertEqual(manifest['levels'], 5)
+        self.assertEqual([level['tiles'] for level in manifest['zoom']],
+                         [1, 2, 4, 8, 16])
+        self.assertEqual(manifest['x_range'], ['2011-01-01', '2013-09-26'])
+        self.assertEqual(manifest['series'][0]['header'], 'value')
+        self.assertEqual(len(rendered), 31)
+        image = imread(os.path.join(self.directory, '0', '0.png'))
+        self.assertEqual(image.shape[:2], (64, 64))
+        self.assertGreater(image[:, :, 3].max(), 0)
+
+        my_plot.append([(numpy.datetime64('2013-09-27'), 0.5)] * 10)
+        rendered = my_plot.export_tiles(self.directory, x_column='day',
+                                        tile_size=64, processes=2)
+        self.assertEqual(sorted(os.path.relpath(filename, self.directory)
+                                for filename in rendered),
+                         [os.path.join(str(level), '%d.png' % tile)
+                          for level, tile in enumerate([0, 1, 3, 7, 15])])
+        my_plot.append([(numpy.datetime64('2013-10-07'), 10.0)])
+        rendered = my_plot.export_tiles(self.directory, x_column='day',
+                                        tile_size=64, processes=2)
+        self.assertEqual(len(rendered), 31)
+
+    def test_export_tiles_should_render_everything_for_other_data(self):
+        day = numpy.datetime64('2011-01-01') + numpy.arange(1000)
+        Plotter({'day': day, 'value': numpy.sin(numpy.arange(1000) / 50.0)}) \
+            .export_tiles(self.directory, x_column='day', tile_size=64)
+        my_plot = Plotter({'day': day,
+                           'value': numpy.cos(numpy.arange(1000) / 50.0)})
+        rendered = my_plot.export_tiles(self.directory, x_column='day',
+                                        tile_size=64)
+        self.assertEqual(len(rendered), 31)
+
+    def test_export_tiles_should_add_levels_when_data_grows(self):
+        my_plot = Plotter({'value': numpy.arange(1000.0)})
+        my_plot.export_tiles(self.directory, tile_size=64)
+        my_plot.append([(float(value),) for value in range(1000, 100000)])
+        my_plot.export_tiles(self.directory, tile_size=64)
+        with open(os.path.join(self.directory, 'manifest.json')) as fp:
+            manifest = json.load(fp)
+        self.assertEqual(manifest['levels'], 12)
+        self.assertEqual(manifest['zoom'][0]['tiles'], 1)
+
+
+class TestDataCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.filename = os.path.join(self.path, 'data.csv')
+        with open(self.filename, 'w') as fp:
+            fp.write('name,quantity,day\ndog,1,2011-01-01\ncat,2,2011-01-02\n')
+        self.cache = DataCache(os.path.join(self.path, 'cache'))
+
+    def test_warm_load_should_memory_map_the_columns(self):
+        cold = self.cache.load(self.filename)
+        warm = self.cache.load(self.filename)
+        self.assertEqual(warm.headers, cold.headers)
+        self.assertEqual(warm.types, cold.types)
+        self.assertIsInstance(warm._columns['quantity'], numpy.memmap)
+        for header in cold.headers:
+            self.assertEqual(list(warm[header]), list(cold[header]))
+        self.assertEqual(len(self.cache.entries()), 1)
+
+    def test_changing_the_source_should_invalidate_its_entry(self):
+        self.cache.load(self.filename)
+        with open(self.filename, 'a') as fp:
+            fp.write('bird,3,2011-01-03\n')
+        os.utime(self.filename, (0, 0))
+        store = self.cache.load(self.filename)
+        self.assertEqual(list(store['name']), ['dog', 'cat', 'bird'])
+        self.assertEqual(len(self.cache.entries()), 2)  # until evicted
+
+    def test_options_should_not_evict_each_other(self):
+        schema = collections.OrderedDict([('name', str), ('quantity', int)])
+        self.cache.load(self.filename, schema=schema)
+        self.cache.load(self.filename, delimiter=';')
+        reversed_schema = collections.OrderedDict(reversed(schema.items()))
+        self.assertEqual(
+                self.cache.key(self.filename, schema={'quantity': 'int',
+                                                      'name': 'str'}),
+                self.cache.key(self.filename, schema={'name': 'str',
+                                                      'quantity': 'int'}))
+        paths = set(entry['path'] for entry in self.cache.entries())
+        self.cache.load(self.filename, schema=reversed_schema)
+        self.cache.load(self.filename, delimiter=';')
+        self.assertEqual(set(entry['path']
+                             for entry in self.cache.entries()), paths)
+
+    def test_should_evict_least_recently_used_entries(self):
+        other_filename = os.path.join(self.path, 'other.csv')
+        shutil.copy(self.filename, other_filename)
+        self.cache.load(self.filename)
+        entry_size = self.cache.entries()[0]['size']
+        self.cache.max_size = entry_size + 16
+        os.utime(self.cache.entries()[0]['path'] + '/meta.json', (0, 0))
+        self.cache.load(other_filename)
+        entries = self.cache.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['source'], other_filename)
+
+    def test_plotter_should_use_the_cache(self):
+        Plotter(self.filename, cache=self.cache.path)
+        my_plot = Plotter(self.filename, cache=self.cache)
+        my_plot.bar(count='name')
+        self.assertEqual(len(self.cache.entries()), 1)
+
+
+class TestFigureLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_column('x', numpy.arange(10), int)
+        self.store.add_column('y', numpy.arange(10) ** 2, int)
+
+    def render(self):
+        with Plotter(self.store, rows=1, cols=2, width=160,
+                     height=120) as my_plot:
+            my_plot.linear(ignore=['x'])
+            my_plot.pie(values_column='y', labels_column='x')
+            my_plot.save(io.BytesIO())
+        return my_plot
+
+    def test_figures_should_not_be_registered_in_pyplot(self):
+        from matplotlib._pylab_helpers import Gcf
+        with Plotter(self.store) as my_plot:
+            my_plot.pie(values_column='y', labels_column='x')
+            my_plot.save(io.BytesIO())
+            self.assertEqual(Gcf.get_all_fig_managers(), [])
+        self.assertIsNone(my_plot.fig)
+
+    @unittest.skipIf(resource is None, 'resource module is not available')
+    def test_memory_should_stay_flat_over_hundreds_of_renders(self):
+        for index in range(20):
+            self.render()
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for index in range(200):
+            self.render()
+        growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+        self.assertTrue(growth < 10 * 1024, 'RSS grew %d KiB' % growth)
+
+
+class TestImport(unittest.TestCase):
+    def test_import_should_not_load_heavy_dependencies(self):
+        code = ('import sys, plotter; print(" ".join(sorted(module '
+                'for module in ("numpy", "matplotlib", "multiprocessing") '
+                'if module in sys.modules)))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode('ascii').strip(), '')
+
+    def test_colormaps_should_be_resolved_by_name(self):
+        store = ColumnStore()
+        store.add_column('x', numpy.arange(3), int)
+        with Plotter(store, rows=2) as my_plot:
+            my_plot.linear(colormap='viridis')
+            import matplotlib.cm
+            my_plot.linear(colormap=matplotlib.cm.gist_heat)
+
+
+class TestAppend(unittest.TestCase):
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_column('name', numpy.array(['dog', 'cat']), str)
+        self.store.add_column('legs', numpy.array([4, 4]), int)
+
+    def test_append_should_grow_columns(self):
+        self.store.append([('bird', 2)])
+        self.store.append([{'name': 'ant', 'legs': 6}])
+        self.store.append([('snake', None)])
+        self.assertEqual(list(self.store['name']),
+                         ['dog', 'cat', 'bird', 'ant', 'snake'])
+        self.assertEqual(list(self.store.codes('name')[1]),
+                         ['ant', 'bird', 'cat', 'dog', 'snake'])
+        self.assertEqual(self.store.types['legs'], float)
+        self.assertEqual(list(self.store['legs'][:4]), [4, 4, 2, 6])
+        self.assertTrue(numpy.isnan(self.store['legs'][4]))
+        for rows in ([('fish', '2011-01-01')], [('fish', 0), ('eel', )]):
+            with self.assertRaises(ValueError):
+                self.store.append(rows)
+            self.assertEqual(len(self.store['name']), 5)
+            self.assertEqual(len(self.store['legs']), 5)
+            self.assertNotIn('fish', self.store.codes('name')[1])
+
+    def test_refresh_should_draw_only_new_segments(self):
+        store = ColumnStore()
+        store.add_column('x', numpy.arange(100), int)
+        store.add_column('y', numpy.sin(numpy.arange(100) / 10.0), float)
+        store.add_column('z', numpy.cos(numpy.arange(100) / 7.0), float)
+        my_plot = Plotter(store, rows=2, width=400, height=400)
+        my_plot.linear(ignore=['x'])
+        my_plot.linear(style='-', ignore=['x', 'z'])
+        line = my_plot._series[0]['line']
+        blits = []
+        draw_new_segments = my_plot._draw_new_segments
+        my_plot._draw_new_segments = lambda start, length: (
+                blits.append((start, length)),
+                draw_new_segments(start, length))
+        self.assertEqual(my_plot.refresh(), 0)
+        my_plot.append([(100, 0.5, 0.5)])
+        self.assertEqual(my_plot.refresh(), 1)
+        for start in range(101, 131, 3):
+            my_plot.append([(x, numpy.sin(x / 10.0), numpy.cos(x / 7.0))
+                            for x in range(start, start + 3)])
+            self.assertEqual(my_plot.refresh(), 3)
+        self.assertEqual(len(my_plot._series[0]['line'].get_xdata()), 131)
+        self.assertGreater(len(blits), 3)
+        # Only lines updated by refresh lose path simplification
+        self.assertFalse(line.get_path().should_simplify)
+        plain = Plotter({'y': numpy.arange(1000.0)})
+        plain.linear(style='-')
+        plain.fig.canvas.draw()
+        self.assertTrue(plain.fig.axes[0].lines[0].get_path().should_simplify)
+        incremental = numpy.array(my_plot.fig.canvas.buffer_rgba())
+        my_plot.fig.canvas.draw()
+        numpy.testing.assert_array_equal(
+                incremental, numpy.array(my_plot.fig.canvas.buffer_rgba()))
+
+    def test_scatter_refresh_should_redraw_the_figure(self):
+        store = ColumnStore()
+        store.add_column('x', numpy.arange(10), int)
+        store.add_column('y', numpy.arange(10) * 2, int)
+        my_plot = Plotter(store)
+        my_plot.scatter(x_column='x')
+        my_plot._draw_new_segments = None
+        my_plot.append([(10, 20)])
+        self.assertEqual(my_plot.refresh(), 1)
+        self.assertEqual(my_plot.fig.axes[0].get_xticklabels()[-1].get_text(),
+                         '10')
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_column('name', numpy.array(['dog', 'cat', 'dog']), str)
+        self.store.add_column('legs', numpy.array([4, 4, 3]), int)
+
+    def test_stats_should_be_disabled_by_default(self):
+        my_plot = Plotter(self.store)
+        my_plot.pie(values_column='legs', labels_column='name')
+        self.assertIsNone(my_plot.stats)
+
+    def test_each_phase_should_be_recorded(self):
+        records = []
+        stats = Stats(callbacks=[records.append], trace_memory=True)
+        my_plot = Plotter(self.store, rows=2, stats=stats)
+        my_plot.bar(count='name')
+        my_plot.pie(values_column='legs', labels_column='name')
+        my_plot.save(io.BytesIO())
+        self.assertIs(my_plot.stats, stats)
+        self.assertEqual([record['phase'] for record in stats],
+                         ['load', 'bar:data', 'bar:artists', 'pie:data',
+                          'pie:artists', 'save'])
+        self.assertEqual(records, stats.records)
+        for record in stats:
+            self.assertEqual(record['rows'], 3)
+            self.assertGreaterEqual(record['seconds'], 0)
+            self.assertGreaterEqual(record['peak_memory'], 0)
+            self.assertFalse(record['failed'])
+        self.assertEqual(stats.records[0]['total_artists'], 0)
+        self.assertEqual(stats.records[1]['artists'], 0)
+        self.assertGreater(stats.records[2]['artists'], 0)
+        self.assertEqual(stats.records[5]['artists'], 0)
+        self.assertEqual(stats.records[5]['total_artists'],
+                         stats.records[4]['total_artists'])
+        self.assertEqual(sorted(stats.totals()),
+                         ['bar:artists', 'bar:data', 'load', 'pie:artists',
+                          'pie:data', 'save'])
+
+    def test_failed_calls_should_be_recorded(self):
+        import tracemalloc
+        stats = Stats(trace_memory=True)
+        my_plot = Plotter(self.store, stats=stats)
+        with self.assertRaises(KeyError):
+            my_plot.pie(values_column='legs', labels_column='no such column')
+        self.assertEqual([(record['phase'], record['failed'])
+                          for record in stats],
+                         [('load', False), ('pie:data', True),
+                          ('pie:artists', True)])
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(stats._running, [])
+
+
+class TestCollections(unittest.TestCase):
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_column('x', numpy.arange(2000), int)
+        self.store.add_column('y', numpy.sin(numpy.arange(2000) / 10.0),
+                              float)
+
+    def test_series_and_bars_should_be_batched_in_collections(self):
+        from matplotlib.collections import (LineCollection, PathCollection,
+                                            PolyCollection)
+        my_plot = Plotter(self.store, rows=2, collections=True)
+        my_plot.linear(ignore=['x'], style='o-')
+        my_plot.bar(count='x', legends=False)
+        linear, bar = my_plot.fig.axes
+        self.assertEqual(len(linear.lines), 0)
+        self.assertEqual([type(collection) for collection in
+                          linear.collections],
+                         [LineCollection, PathCollection])
+        self.assertEqual(len(bar.patches), 0)
+        self.assertEqual(type(bar.collections[0]), PolyCollection)
+        self.assertEqual(len(bar.collections[0].get_paths()), 2000)
+        with self.assertRaises(ValueError):
+            my_plot.refresh()
+
+    def test_styles_should_be_split_like_plot_does(self):
+        import matplotlib.pyplot as plt
+        figure, subplot = plt.subplots()
+        self.addCleanup(plt.close, figure)
+        for style in ('o-', '-', 'o', 'r--', 's:', 'C1.', '', 'x-.'):
+            line = subplot.plot([], [], style)[0]
+            self.assertEqual(_split_style(style),
+                             (line.get_linestyle(), line.get_marker()))
+        with self.assertRaises(ValueError):
+            _split_style('o-?')
+
+    def test_rasterized_data_should_shrink_vector_output(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        store = ColumnStore()
+        store.add_column('y', numpy.sin(numpy.arange(20000) / 10.0), float)
+        contents = []
+        for rasterize_data in (False, True):
+            my_plot = Plotter(store, rasterize_data=rasterize_data)
+            my_plot.linear(style='o-')
+            filename = os.path.join(temp_dir, '%s.svg' % rasterize_data)
+            my_plot.save(filename)
+            with open(filename, 'rb') as fp:
+                contents.append(fp.read())
+        self.assertNotIn(b'<image', contents[0])
+        self.assertIn(b'<image', contents[1])
+        self.assertLess(len(contents[1]) * 10, len(contents[0]))
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.store = ColumnStore()
+        self.store.add_column('y', numpy.sin(numpy.arange(500) / 10.0), float)
+        self.plot = Plotter(self.store, width=400, height=300)
+        self.plot.linear(style='-')
+
+    def test_render_should_return_bytes(self):
+        image = self.plot.render()
+        self.assertTrue(image.startswith(b'\x89PNG'))
+        self.assertTrue(self.plot.render(format='svg').startswith(b'<?xml'))
+        output = io.BytesIO()
+        self.assertIs(self.plot.render(output, format='pdf'), output)
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
+
+    def test_render_options(self):
+        fast = self.plot.render(compression=0)
+        small = self.plot.render(compression=9)
+        self.assertLess(len(small), len(fast))
+        bigger = self.plot.render(dpi=160)
+        self.assertNotEqual(bigger[16:24], small[16:24])  # width, height
+        with self.assertRaises(ValueError):
+            self.plot.render(format='svg', compression=9)
+
+    def test_save_async_should_return_a_future(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        filename = os.path.join(temp_dir, 'async.png')
+        future = self.plot.save_async(filename, compression=1)
+        self.assertEqual(future.result(timeout=60), filename)
+        with open(filename, 'rb') as fp:
+            self.assertTrue(fp.read().startswith(b'\x89PNG'))
+
+
+class TestDeferred(unittest.TestCase):
+    def dashboard(self, **options):
+        random = numpy.random.RandomState(5)
+        day = numpy.datetime64('2011-01-01') + \
+              numpy.sort(random.randint(0, 365, 5000))
+        data = {'day': day, 'value': random.normal(10, 2, 5000),
+                'kind': numpy.array(['a', 'b', 'c'])[
+                        random.randint(0, 3, 5000)]}
+        my_plot = Plotter(data, rows=3, cols=3, width=600, height=600,
+                          **options)
+        my_plot.linear(ignore=['day', 'kind'], downsample='lttb')
+        my_plot.scatter('day', ignore=['kind'], downsample='minmax',
+                        order_by='value')
+        my_plot.scatter('day', ignore=['kind'], density=4)
+        my_plot.scatter('day', ignore=['kind'], resample='1W',
+                        resample_how='band')
+        my_plot.bar(count='kind')
+        my_plot.bar(x_column='kind', y_columns=['value'], aggregate='mean')
+        my_plot.stacked_bar('day', 'value', 'kind')
+        my_plot.radar('kind', 'value', 'kind')
+        my_plot.pie('value', 'kind')
+        return my_plot
+
+    def test_deferred_plotter_should_render_the_same_image(self):
+        expected = self.dashboard().render()
+        my_plot = self.dashboard(deferred=True, processes=3)
+        self.assertEqual(len(my_plot.fig.axes), 0)
+        self.assertEqual(my_plot.render(), expected)
+        self.assertEqual(len(my_plot._sort_indexes), 1)  # before forking
+        my_plot.draw()  # nothing left to draw
+        self.assertEqual(my_plot.render(), expected)
+        serial = self.dashboard(deferred=True, processes=1)
+        self.assertEqual(serial.render(), expected)
+
+    def test_deferred_plotter_should_not_fork_from_other_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        expected = self.dashboard().render()
+        my_plot = self.dashboard(deferred=True, processes=3)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(executor.submit(my_plot.render).result(),
+                             expected)
+        self.assertEqual(len(my_plot._sort_indexes), 1)  # sorted here
+
+    def test_workers_should_not_send_back_plain_columns(self):
+        my_plot = Plotter(self.dashboard(deferred=True).data, rows=2)
+        my_plot._recorded = []
+        my_plot.linear(ignore=['day', 'kind'])
+        self.assertEqual(my_plot._recorded, [])
+        my_plot.scatter('day', ignore=['kind'], order_by='value')
+        x_values, y_values = my_plot._recorded[1]
+        self.assertIsNone(x_values)
+        self.assertEqual(len(y_values), 5000)